@@ -1,34 +1,43 @@
 from flask import Flask, render_template, request, jsonify, send_file, Response
-import subprocess
 import os
-import threading
-import yt_dlp
 import re
+import json
+import mimetypes
 import requests
 import shutil
 import zipfile
 import tempfile
-import time
 from datetime import datetime
 
+from jobs import JobManager, QueueFull
+from jobstore import JobStore, FINISHED_STATES
+from profiles import OUTPUT_PROFILES, DEFAULT_PROFILE
+from capabilities import get_capabilities
+from caches import get_metadata_cache, get_source_audio_cache, get_processed_audio_cache
+from queues import QUEUE_BACKEND, open_queue_backend
+from render import SCRIPT_DIR, OUTPUT_DIR, FFMPEG_PATH, FFPROBE_PATH, process_video_task, init_worker, default_worker_count, estimate_job_cost
+
 app = Flask(__name__)
 
-# Get the directory where the script is located
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-# Define paths to FFmpeg executables
-FFMPEG_PATH = os.path.join(SCRIPT_DIR, "ffmpeg.exe")
-FFPROBE_PATH = os.path.join(SCRIPT_DIR, "ffprobe.exe")
+# 'thread' runs renders inside the web process, 'process' hands them to a pool of worker processes
+EXECUTOR_MODE = os.environ.get('SPEDUP_EXECUTOR', 'thread')
+
+# Number of renders allowed to run at the same time, defaults to what the CPU can take.
+# With a queue backend (SPEDUP_QUEUE_BACKEND) set it to the total worker slots, it only feeds wait estimates
+MAX_CONCURRENT_JOBS = int(os.environ.get('SPEDUP_MAX_JOBS', 0)) or default_worker_count()
+
+# Admission control: jobs allowed to wait in the queue, and the longest estimated wait (seconds) a new job may face
+MAX_QUEUE_DEPTH = int(os.environ.get('SPEDUP_MAX_QUEUE', 20))
+MAX_QUEUE_WAIT = float(os.environ.get('SPEDUP_MAX_QUEUE_WAIT', 0)) or None
 
-# Global variables for progress tracking
-processing_status = {
-    'status': 'idle',
-    'progress': 0,
-    'message': '',
-    'output_file': None
-}
+# Shortest-job-first aging: seconds of estimated cost forgiven for every second a job has waited
+SJF_AGING = float(os.environ.get('SPEDUP_SJF_AGING', 1.0))
 
-def quote_path(path):
-    return f'"{path}"'
+# SQLite database holding job records and history
+JOB_DB_PATH = os.environ.get('SPEDUP_JOB_DB', os.path.join(SCRIPT_DIR, 'jobs.db'))
+
+# How often an idle progress stream sends a keep-alive comment
+SSE_KEEPALIVE_SECONDS = 15
 
 def download_ffmpeg():
     """Download FFmpeg executables if they don't exist"""
@@ -90,284 +99,10 @@ def download_ffmpeg():
         print(f"Error downloading FFmpeg: {e}")
         return False
 
-def check_nvidia_gpu():
-    """Check if NVIDIA GPU is available for hardware acceleration."""
-    try:
-        # Check if the NVENC encoder is available
-        result = subprocess.run(
-            [FFMPEG_PATH, '-hide_banner', '-encoders'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        # Look for NVIDIA hardware encoders in the output
-        if 'h264_nvenc' in result.stdout:
-            print("NVIDIA hardware acceleration available")
-            return True
-        else:
-            print("NVIDIA hardware acceleration not detected")
-            return False
-    except Exception as e:
-        print(f"Error checking for hardware acceleration: {e}")
-        return False
-
-def process_video_task(youtube_url, media_type, bg_url, speed_choice, save_credits, custom_speed=None):
-    """Background task for video processing"""
-    global processing_status
-    
-    try:
-        processing_status['status'] = 'processing'
-        processing_status['progress'] = 10
-        processing_status['message'] = 'Starting video processing...'
-        
-        # Initialize filenames
-        video_filename = "video.mp4"
-        audio_filename = "audio.mp3"
-        
-        if media_type == "gif":
-            bg_filename = "background.gif"
-        else:
-            bg_filename = "background.jpg"
-        
-        # Download selected background
-        processing_status['progress'] = 15
-        processing_status['message'] = f'Downloading {"GIF" if media_type == "gif" else "Image"}...'
-        
-        # Download with better error handling and headers
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        try:
-            response = requests.get(bg_url, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            # Check if we actually got image data
-            content_type = response.headers.get('content-type', '')
-            if not any(img_type in content_type.lower() for img_type in ['image', 'gif']):
-                print(f"Warning: Content-Type is {content_type}, might not be an image")
-            
-            bg_data = response.content
-            if len(bg_data) == 0:
-                raise Exception("Downloaded file is empty")
-                
-            with open(bg_filename, 'wb') as f:
-                f.write(bg_data)
-                
-            print(f"Downloaded background: {len(bg_data)} bytes, Content-Type: {content_type}")
-            
-            # Verify the downloaded file is a valid image using FFprobe
-            try:
-                probe_command = f'{quote_path(FFPROBE_PATH)} -v error -select_streams v:0 -show_entries stream=codec_name,width,height -of csv=p=0 {quote_path(bg_filename)}'
-                probe_result = subprocess.run(probe_command, shell=True, capture_output=True, text=True)
-                if probe_result.returncode == 0:
-                    print(f"Image validation successful: {probe_result.stdout.strip()}")
-                else:
-                    print(f"Image validation failed: {probe_result.stderr}")
-                    raise Exception(f"Downloaded file is not a valid image: {probe_result.stderr}")
-            except Exception as probe_error:
-                print(f"Image validation error: {probe_error}")
-                raise Exception(f"Downloaded image file is corrupted or invalid")
-            
-        except Exception as e:
-            raise Exception(f"Failed to download background image: {str(e)}")
-        
-        # Get video info and create output filename
-        processing_status['progress'] = 25
-        processing_status['message'] = 'Getting video info...'
-        video_info = yt_dlp.YoutubeDL().extract_info(youtube_url, download=False)
-        
-        # Create appropriate filename based on speed choice
-        if speed_choice == "slow":
-            prefix = "slowed_down_"
-        else:  # speed up
-            prefix = "nightcore_"
-            
-        # More thorough sanitization of the filename
-        video_title = video_info['title']
-        sanitized_title = re.sub(r'[^a-zA-Z0-9]', '_', video_title)
-        sanitized_title = re.sub(r'_{2,}', '_', sanitized_title)
-        if len(sanitized_title) > 50:
-            sanitized_title = sanitized_title[:50]
-        sanitized_filename = f"{prefix}{sanitized_title}"
-        output_video = f"{sanitized_filename}.mp4"
-        
-        # Download YouTube audio only
-        processing_status['progress'] = 35
-        processing_status['message'] = 'Downloading audio...'
-        base_audio_name = os.path.splitext(audio_filename)[0]
-        ydl_opts = {
-            'outtmpl': base_audio_name,
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([youtube_url])
-        
-        # Find the actual downloaded audio file
-        downloaded_audio = None
-        if os.path.exists(audio_filename):
-            downloaded_audio = audio_filename
-        elif os.path.exists(f"{audio_filename}.mp3"):
-            downloaded_audio = f"{audio_filename}.mp3"
-        elif os.path.exists(f"{base_audio_name}.mp3"):
-            downloaded_audio = f"{base_audio_name}.mp3"
-        else:
-            raise Exception("Could not find downloaded audio file")
-        
-        # Process audio (change pitch/speed)
-        processing_status['progress'] = 50
-        processing_status['message'] = 'Processing audio...'
-        
-        # Use custom speed if provided, otherwise use defaults
-        if custom_speed is not None:
-            pitch = custom_speed
-        else:
-            pitch = 0.9 if speed_choice == "slow" else 1.4
-        
-        processed_audio = "processed_audio.mp3"
-        command = f'{quote_path(FFMPEG_PATH)} -i {quote_path(downloaded_audio)} -af "asetrate=44100*{pitch},aresample=44100" -acodec libmp3lame {quote_path(processed_audio)} -y'
-        subprocess.run(command, shell=True)
-        
-        # Clean up original downloaded file and rename processed file
-        if os.path.exists(downloaded_audio):
-            os.remove(downloaded_audio)
-        os.rename(processed_audio, audio_filename)
-        
-        # Get audio duration
-        processing_status['progress'] = 65
-        processing_status['message'] = 'Preparing final video...'
-        result = subprocess.run(
-            [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', audio_filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        audio_duration = float(result.stdout)
-        
-        # Check hardware acceleration
-        has_hw_accel = check_nvidia_gpu()
-        
-        # Process based on media type
-        processing_status['progress'] = 75
-        processing_status['message'] = 'Creating video...'
-        
-        if media_type == "gif":
-            # Create video from GIF - use original resolution
-            temp_video = "looped_video.mp4"
-            
-            video_encoder = "-c:v h264_nvenc -preset p4 -tune hq -b:v 5M" if has_hw_accel else "-c:v libx264"
-            command = f'{quote_path(FFMPEG_PATH)} -stream_loop -1 -i {quote_path(bg_filename)} -vf "scale=trunc(iw/2)*2:trunc(ih/2)*2" -t {audio_duration} -pix_fmt yuv420p {video_encoder} -r 30 {quote_path(temp_video)} -y'
-            
-            try:
-                subprocess.run(command, shell=True, check=True)
-            except subprocess.CalledProcessError:
-                # Fallback: try without scaling to preserve original resolution
-                command = f'{quote_path(FFMPEG_PATH)} -stream_loop -1 -i {quote_path(bg_filename)} -t {audio_duration} -pix_fmt yuv420p -c:v libx264 -r 30 {quote_path(temp_video)} -y'
-                subprocess.run(command, shell=True)
-        else:
-            # Create video from static image
-            temp_video = "image_video.mp4"
-            
-            # Resize image first with better error handling
-            resized_image = "resized_background.jpg"
-            
-            # Try with pixel format conversion first
-            resize_command = f'{quote_path(FFMPEG_PATH)} -i {quote_path(bg_filename)} -vf "scale=trunc(iw/2)*2:trunc(ih/2)*2" -pix_fmt rgb24 {quote_path(resized_image)} -y'
-            try:
-                subprocess.run(resize_command, shell=True, check=True)
-            except subprocess.CalledProcessError:
-                print("First resize attempt failed, trying with different format...")
-                # Fallback: try without pixel format specification
-                resize_command = f'{quote_path(FFMPEG_PATH)} -i {quote_path(bg_filename)} -vf "scale=trunc(iw/2)*2:trunc(ih/2)*2" {quote_path(resized_image)} -y'
-                try:
-                    subprocess.run(resize_command, shell=True, check=True)
-                except subprocess.CalledProcessError:
-                    print("Second resize attempt failed, trying simpler scaling...")
-                    # Fallback: try with simpler scaling
-                    resize_command = f'{quote_path(FFMPEG_PATH)} -i {quote_path(bg_filename)} -vf "scale=1280:720" {quote_path(resized_image)} -y'
-                    subprocess.run(resize_command, shell=True, check=True)
-            
-            video_encoder = "-c:v h264_nvenc -preset p4 -tune hq -b:v 5M" if has_hw_accel else "-c:v libx264"
-            video_command = f'{quote_path(FFMPEG_PATH)} -loop 1 -i {quote_path(resized_image)} {video_encoder} -t {audio_duration} -pix_fmt yuv420p -r 30 {quote_path(temp_video)} -y'
-            
-            try:
-                subprocess.run(video_command, shell=True, check=True)
-            except subprocess.CalledProcessError:
-                video_command = f'{quote_path(FFMPEG_PATH)} -loop 1 -i {quote_path(resized_image)} -c:v libx264 -t {audio_duration} -pix_fmt yuv420p -r 30 {quote_path(temp_video)} -y'
-                subprocess.run(video_command, shell=True, check=True)
-            
-            if os.path.exists(resized_image):
-                os.remove(resized_image)
-        
-        # Combine video and audio
-        processing_status['progress'] = 85
-        processing_status['message'] = 'Combining video and audio...'
-        
-        current_dir_output = output_video
-        
-        if has_hw_accel:
-            command = f'{quote_path(FFMPEG_PATH)} -hwaccel cuda -i {quote_path(temp_video)} -i {quote_path(audio_filename)} -c:v h264_nvenc -preset p4 -tune hq -b:v 5M -c:a aac -strict experimental -b:a 192k -shortest {quote_path(current_dir_output)} -y'
-            try:
-                subprocess.run(command, shell=True, check=True)
-            except subprocess.CalledProcessError:
-                command = f'{quote_path(FFMPEG_PATH)} -i {quote_path(temp_video)} -i {quote_path(audio_filename)} -c:v copy -c:a aac -strict experimental -b:a 192k -shortest {quote_path(current_dir_output)} -y'
-                subprocess.run(command, shell=True)
-        else:
-            command = f'{quote_path(FFMPEG_PATH)} -i {quote_path(temp_video)} -i {quote_path(audio_filename)} -c:v libx264 -preset fast -crf 22 -c:a aac -strict experimental -b:a 192k -shortest {quote_path(current_dir_output)} -y'
-            try:
-                subprocess.run(command, shell=True, check=True)
-            except subprocess.CalledProcessError:
-                command = f'{quote_path(FFMPEG_PATH)} -i {quote_path(temp_video)} -i {quote_path(audio_filename)} -c:v copy -c:a aac -strict experimental -b:a 192k -shortest {quote_path(current_dir_output)} -y'
-                subprocess.run(command, shell=True)
-        
-        # Clean up temporary files
-        processing_status['progress'] = 95
-        processing_status['message'] = 'Cleaning up...'
-        try:
-            os.remove(audio_filename)
-            os.remove(bg_filename)
-            os.remove(temp_video)
-        except Exception as e:
-            print(f"Warning: Could not remove temporary file: {e}")
-        
-        # Move to outputs folder
-        output_folder = os.path.join(SCRIPT_DIR, "outputs")
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-        
-        # Find the created file
-        if not os.path.exists(current_dir_output):
-            possible_files = [f for f in os.listdir('.') if f.endswith('.mp4')]
-            if possible_files:
-                current_dir_output = possible_files[0]
-            else:
-                raise Exception("No MP4 output file found")
-        
-        # Move to outputs folder
-        output_path = os.path.join(output_folder, os.path.basename(current_dir_output))
-        if os.path.exists(output_path):
-            timestamp = int(time.time())
-            filename_parts = os.path.splitext(os.path.basename(current_dir_output))
-            new_filename = f"{filename_parts[0]}_{timestamp}{filename_parts[1]}"
-            output_path = os.path.join(output_folder, new_filename)
-        
-        shutil.copy2(current_dir_output, output_path)
-        os.remove(current_dir_output)
-        
-        processing_status['status'] = 'complete'
-        processing_status['progress'] = 100
-        processing_status['message'] = 'Video created successfully!'
-        processing_status['output_file'] = output_path
-        
-    except Exception as e:
-        processing_status['status'] = 'error'
-        processing_status['message'] = f'Error creating video: {str(e)}'
-        print(f"Error in video processing: {e}")
+job_store = JobStore(JOB_DB_PATH)
+job_manager = JobManager(process_video_task, MAX_CONCURRENT_JOBS, job_store, mode=EXECUTOR_MODE, initializer=init_worker,
+                         max_queue_depth=MAX_QUEUE_DEPTH, max_queue_wait=MAX_QUEUE_WAIT,
+                         cost_estimator=estimate_job_cost, aging=SJF_AGING, backend=open_queue_backend(QUEUE_BACKEND))
 
 @app.route('/')
 def index():
@@ -375,40 +110,121 @@ def index():
 
 @app.route('/api/process', methods=['POST'])
 def process_video():
-    global processing_status
-    
-    if processing_status['status'] == 'processing':
-        return jsonify({'error': 'Already processing a video'}), 400
-    
     data = request.json
     youtube_url = data.get('youtube_url')
     media_type = data.get('media_type')  # 'gif' or 'image'
     bg_url = data.get('bg_url')
+    bg_video_url = data.get('bg_video_url')  # optional MP4 rendition of a GIF, rendered instead of the GIF when it works
     speed_choice = data.get('speed_choice')  # 'fast', 'slow', or 'custom'
     custom_speed = data.get('custom_speed')  # float value for custom speed
     save_credits = data.get('save_credits', False)
+    profile = data.get('profile') or DEFAULT_PROFILE  # output profile name, see /api/profiles
     
-    if not all([youtube_url, media_type, bg_url, speed_choice]):
+    if profile not in OUTPUT_PROFILES:
+        return jsonify({'error': f'Unknown output profile: {profile}'}), 400
+    # Audio-only profiles render no video, so they need no background
+    required = [youtube_url, speed_choice]
+    if OUTPUT_PROFILES[profile]['codec'] is not None:
+        required += [media_type, bg_url]
+    if not all(required):
         return jsonify({'error': 'Missing required parameters'}), 400
     
-    # Reset processing status
-    processing_status = {
-        'status': 'processing',
-        'progress': 0,
-        'message': 'Starting...',
-        'output_file': None
-    }
+    # Queue the job; the executor runs up to MAX_CONCURRENT_JOBS at once
+    estimated_wait = job_manager.queue_stats()['estimated_wait']
+    try:
+        job_id = job_manager.submit({
+            'youtube_url': youtube_url,
+            'media_type': media_type,
+            'bg_url': bg_url,
+            'bg_video_url': bg_video_url,
+            'speed_choice': speed_choice,
+            'save_credits': save_credits,
+            'custom_speed': custom_speed,
+            'profile': profile,
+        })
+    except QueueFull as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after, 'estimated_wait': e.estimated_wait})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    return jsonify({
+        'message': 'Processing started',
+        'job_id': job_id,
+        'estimated_wait': estimated_wait,
+    })
+
+@app.route('/api/profiles')
+def list_profiles():
+    profiles = [dict(settings, name=name) for name, settings in OUTPUT_PROFILES.items()]
+    return jsonify({'profiles': profiles, 'default': DEFAULT_PROFILE})
+
+@app.route('/api/cache')
+def cache_stats():
+    return jsonify({
+        'metadata': get_metadata_cache().stats(),
+        'source_audio': get_source_audio_cache().stats(),
+        'processed_audio': get_processed_audio_cache().stats(),
+    })
+
+@app.route('/api/queue')
+def queue_status():
+    return jsonify(job_manager.queue_stats())
+
+@app.route('/api/jobs')
+def list_jobs():
+    states = [state for state in request.args.get('state', '').split(',') if state]
+    limit = int(request.args.get('limit', 100))
+    return jsonify({'jobs': job_manager.list(states, limit)})
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': f"Job is already {job['status']}"}), 409
+    return jsonify(job_manager.get(job_id)), 202
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status, closed once the job finishes"""
+    if job_manager.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
     
-    # Start processing in background thread
-    thread = threading.Thread(target=process_video_task, args=(youtube_url, media_type, bg_url, speed_choice, save_credits, custom_speed))
-    thread.daemon = True
-    thread.start()
+    def generate():
+        version = -1
+        while True:
+            job, new_version = job_manager.wait_for_update(job_id, version, timeout=SSE_KEEPALIVE_SECONDS)
+            if job is None:
+                return
+            if new_version == version:
+                # Comment line keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            version = new_version
+            yield f'data: {json.dumps(job)}\n\n'
+            if job['status'] in FINISHED_STATES:
+                return
     
-    return jsonify({'message': 'Processing started'})
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/api/status')
 def get_status():
-    return jsonify(processing_status)
+    """Status of the most recent job, kept for clients that predate job IDs"""
+    job = job_manager.latest()
+    if job is None:
+        return jsonify({'status': 'idle', 'progress': 0, 'message': '', 'output_file': None})
+    return jsonify(job)
 
 @app.route('/api/gif-search')
 def search_gifs():
@@ -425,7 +241,8 @@ def search_gifs():
             'key': api_key,
             'limit': 12,
             'pos': offset,  # Tenor uses 'pos' for offset
-            'media_filter': 'minimal',
+            # GIFs are rendered from the much smaller MP4 renditions when Tenor has them
+            'media_filter': 'gif,tinygif,mp4,loopedmp4',
             'contentfilter': 'high'
         }
         
@@ -434,9 +251,13 @@ def search_gifs():
         
         gifs = []
         for result in data.get('results', []):
+            media_formats = result['media_formats']
+            # A single-cycle mp4 is preferred; the renderer does the looping itself
+            video = media_formats.get('mp4') or media_formats.get('loopedmp4') or {}
             gifs.append({
-                'url': result['media_formats']['gif']['url'],
-                'preview': result['media_formats']['tinygif']['url']
+                'url': media_formats['gif']['url'],
+                'preview': media_formats['tinygif']['url'],
+                'video_url': video.get('url')
             })
         
         return jsonify({'gifs': gifs, 'hasMore': len(gifs) == 12})
@@ -553,8 +374,7 @@ def get_images():
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    output_folder = os.path.join(SCRIPT_DIR, "outputs")
-    file_path = os.path.join(output_folder, filename)
+    file_path = os.path.join(OUTPUT_DIR, filename)
     if os.path.exists(file_path):
         return send_file(file_path, as_attachment=True)
     return "File not found", 404
@@ -562,8 +382,7 @@ def download_file(filename):
 @app.route('/video/<filename>')
 def serve_video(filename):
     """Serve video files for streaming in the browser with range support"""
-    output_folder = os.path.join(SCRIPT_DIR, "outputs")
-    file_path = os.path.join(output_folder, filename)
+    file_path = os.path.join(OUTPUT_DIR, filename)
     
     if not os.path.exists(file_path):
         return "File not found", 404
@@ -576,6 +395,8 @@ def serve_video(filename):
                 data = f.read(1024)
     
     file_size = os.path.getsize(file_path)
+    # Audio-only profiles produce .m4a/.mp3 files
+    content_type = mimetypes.guess_type(file_path)[0] or 'video/mp4'
     
     # Handle range requests for video streaming
     range_header = request.headers.get('Range', None)
@@ -610,7 +431,7 @@ def serve_video(filename):
                 'Content-Range': f'bytes {byte_start}-{byte_end}/{file_size}',
                 'Accept-Ranges': 'bytes',
                 'Content-Length': str(byte_end - byte_start + 1),
-                'Content-Type': 'video/mp4',
+                'Content-Type': content_type,
             }
         )
         return response
@@ -619,7 +440,7 @@ def serve_video(filename):
     return Response(
         generate(),
         headers={
-            'Content-Type': 'video/mp4',
+            'Content-Type': content_type,
             'Accept-Ranges': 'bytes',
             'Content-Length': str(file_size)
         }
@@ -631,6 +452,12 @@ if __name__ == '__main__':
         print("Failed to download FFmpeg. Please download it manually.")
         exit(1)
     
+    # The debug reloader runs this block in a watcher process too; only the serving child resumes jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Probe (or load the cached) encoders, filters and hwaccels once instead of in every job
+        get_capabilities(FFMPEG_PATH)
+        job_manager.start()
+    
     print("Starting Spedup-Slowed-MV Web Interface...")
     print("Open your browser and go to: http://localhost:5000")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
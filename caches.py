@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import yt_dlp
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# SQLite file holding cached track metadata, shared by the web app, render workers and the CLI
+METADATA_CACHE_PATH = os.environ.get('SPEDUP_METADATA_CACHE', os.path.join(SCRIPT_DIR, 'metadata_cache.db'))
+# How long cached metadata is trusted before the track is extracted again
+METADATA_TTL_SECONDS = float(os.environ.get('SPEDUP_METADATA_TTL', 7 * 24 * 60 * 60))
+# Tracks kept in the cache; the least recently used ones are dropped beyond this
+METADATA_MAX_ENTRIES = int(os.environ.get('SPEDUP_METADATA_MAX_ENTRIES', 5000))
+
+# Directory of the audio caches, and the disk space the downloaded audio may use before the least recently used files go
+AUDIO_CACHE_DIR = os.environ.get('SPEDUP_AUDIO_CACHE_DIR', os.path.join(SCRIPT_DIR, 'audio_cache'))
+SOURCE_AUDIO_CACHE_BYTES = int(os.environ.get('SPEDUP_SOURCE_AUDIO_CACHE_BYTES', 2 * 1024 ** 3))
+PROCESSED_AUDIO_CACHE_BYTES = int(os.environ.get('SPEDUP_PROCESSED_AUDIO_CACHE_BYTES', 1024 ** 3))
+
+# Fields of a yt-dlp info dict worth keeping; format URLs expire within hours, so formats are not cached
+METADATA_FIELDS = ('id', 'extractor_key', 'title', 'duration', 'thumbnail', 'thumbnails', 'webpage_url')
+# Fields describing the format yt-dlp chose, kept per format selector since each selector picks differently
+FORMAT_FIELDS = ('format_id', 'ext', 'acodec', 'abr')
+
+_metadata_cache = None
+_source_audio_cache = None
+_processed_audio_cache = None
+_cache_lock = threading.Lock()
+
+
+class MetadataCache:
+    """Persistent cache of yt-dlp extract_info results, keyed by extractor and video ID
+
+    Entries expire after a TTL and the least recently used ones are evicted
+    once the cache holds more than max_entries. Hit and miss counts are kept
+    in the database, so they cover every process sharing the file.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (
+        key TEXT PRIMARY KEY,
+        info TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_metadata_last_used ON metadata (last_used_at);
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    def __init__(self, path, ttl=METADATA_TTL_SECONDS, max_entries=METADATA_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self.SCHEMA)
+
+    def _count(self, name):
+        self._conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def get(self, key):
+        """Return the cached metadata for key, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT info, fetched_at FROM metadata WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute('DELETE FROM metadata WHERE key = ?', (key,))
+                self._count('misses')
+                return None
+            self._conn.execute('UPDATE metadata SET last_used_at = ? WHERE key = ?', (now, key))
+            self._count('hits')
+        return json.loads(row[0])
+
+    def put(self, key, info, format_selector=None):
+        """Store the cacheable fields of an info dict under key, evicting the least recently used entries
+
+        The chosen format is recorded under format_selector in the entry's
+        'chosen_formats', next to what other selectors chose for the track;
+        without a selector (yt-dlp's default video+audio choice) it is not recorded.
+        """
+        now = time.time()
+        entry = {field: info[field] for field in METADATA_FIELDS if info.get(field) is not None}
+        with self._lock:
+            row = self._conn.execute('SELECT info FROM metadata WHERE key = ?', (key,)).fetchone()
+            chosen_formats = json.loads(row[0]).get('chosen_formats', {}) if row else {}
+            if format_selector and info.get('format_id'):
+                chosen_formats[format_selector] = {field: info[field] for field in FORMAT_FIELDS if info.get(field) is not None}
+            if chosen_formats:
+                entry['chosen_formats'] = chosen_formats
+            self._conn.execute(
+                'INSERT OR REPLACE INTO metadata (key, info, fetched_at, last_used_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(entry), now, now)
+            )
+            self._conn.execute(
+                'DELETE FROM metadata WHERE key IN '
+                '(SELECT key FROM metadata ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        return entry
+
+    def stats(self):
+        """Entry count, hit and miss counters and the resulting hit rate"""
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+            counters = dict(self._conn.execute('SELECT name, value FROM counters').fetchall())
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 3) if lookups else None,
+        }
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileCache:
+    """Content-addressed file store under a byte quota, indexed in SQLite
+
+    Files are stored once under the SHA-256 of their content, however many
+    keys point at them, and are written to a temporary name and moved into
+    place with os.replace, so readers never see a partial file. Jobs get
+    their own hard link or copy, which stays valid if the entry is evicted
+    meanwhile. Once the files add up to more than max_bytes, the least
+    recently used entries are dropped.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        ext TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        meta TEXT NOT NULL DEFAULT '{}',
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used_at);
+    CREATE INDEX IF NOT EXISTS idx_entries_sha256 ON entries (sha256);
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False,
+                                     isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self.SCHEMA)
+
+    def _blob_path(self, sha256, ext):
+        return os.path.join(self.directory, sha256 + ext)
+
+    def _count(self, name):
+        self._conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def fetch(self, key, destination_base):
+        """Link or copy the file cached under key to destination_base plus its extension
+
+        Returns (path, entry) with entry holding sha256, size and the meta
+        stored with the file, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT sha256, ext, size, meta FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._conn.execute('UPDATE entries SET last_used_at = ? WHERE key = ?', (time.time(), key))
+        if row is not None:
+            sha256, ext, size, meta = row
+            destination = destination_base + ext
+            try:
+                try:
+                    os.link(self._blob_path(sha256, ext), destination)
+                except OSError:
+                    # Different filesystem, or no hard links: fall back to a copy
+                    shutil.copyfile(self._blob_path(sha256, ext), destination)
+            except OSError:
+                # Evicted by another process since the lookup, or removed by hand
+                with self._lock:
+                    self._conn.execute('DELETE FROM entries WHERE key = ? AND sha256 = ?', (key, sha256))
+                row = None
+        with self._lock:
+            self._count('hits' if row is not None else 'misses')
+        if row is None:
+            return None
+        return destination, {'sha256': sha256, 'size': size, 'meta': json.loads(meta)}
+
+    def put(self, key, source_file, meta=None):
+        """Store a copy of source_file under key and return its SHA-256; the source is left in place"""
+        ext = os.path.splitext(source_file)[1]
+        sha256 = file_sha256(source_file)
+        size = os.path.getsize(source_file)
+        if size > self.max_bytes:
+            return sha256
+        
+        blob_path = self._blob_path(sha256, ext)
+        if not os.path.exists(blob_path):
+            temp_path = f'{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            shutil.copyfile(source_file, temp_path)
+            os.replace(temp_path, blob_path)
+        
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (key, sha256, ext, size, meta, created_at, last_used_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, sha256, ext, size, json.dumps(meta or {}), now, now)
+            )
+            self._evict()
+        return sha256
+
+    def _evict(self):
+        """Drop least recently used entries until the files fit max_bytes, deleting files nothing points at"""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, sha256, ext, size in self._conn.execute(
+                'SELECT key, sha256, ext, size FROM entries ORDER BY last_used_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            if self._conn.execute('SELECT 1 FROM entries WHERE sha256 = ?', (sha256,)).fetchone() is None:
+                try:
+                    os.remove(self._blob_path(sha256, ext))
+                except OSError as e:
+                    print(f"Warning: Could not remove cached file {sha256}{ext}: {e}")
+
+    def stats(self):
+        """Entry count, bytes used, hit and miss counters and the resulting hit rate"""
+        with self._lock:
+            entries, used = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            counters = dict(self._conn.execute('SELECT name, value FROM counters').fetchall())
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            'entries': entries,
+            'bytes': used,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 3) if lookups else None,
+        }
+
+
+def get_metadata_cache():
+    """The process-wide metadata cache, opened on first use"""
+    global _metadata_cache
+    with _cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache(METADATA_CACHE_PATH)
+    return _metadata_cache
+
+
+def get_source_audio_cache():
+    """The process-wide cache of downloaded source audio, opened on first use"""
+    global _source_audio_cache
+    with _cache_lock:
+        if _source_audio_cache is None:
+            _source_audio_cache = FileCache(os.path.join(AUDIO_CACHE_DIR, 'source'), SOURCE_AUDIO_CACHE_BYTES)
+    return _source_audio_cache
+
+
+def get_processed_audio_cache():
+    """The process-wide cache of speed-changed audio, opened on first use"""
+    global _processed_audio_cache
+    with _cache_lock:
+        if _processed_audio_cache is None:
+            _processed_audio_cache = FileCache(os.path.join(AUDIO_CACHE_DIR, 'processed'), PROCESSED_AUDIO_CACHE_BYTES)
+    return _processed_audio_cache
+
+
+def metadata_key(url):
+    """'<extractor>:<video id>' for a URL, worked out without any network request; None if unknown"""
+    for extractor in yt_dlp.extractor.gen_extractor_classes():
+        if extractor.ie_key() == 'Generic' or not extractor.suitable(url):
+            continue
+        try:
+            video_id = extractor.get_temp_id(url)
+        except Exception:
+            video_id = None
+        return f'{extractor.ie_key()}:{video_id}' if video_id else None
+    return None
+
+
+def cached_extract_info(ydl, url):
+    """Metadata of a track, from the cache when possible, otherwise from ydl.extract_info(url, download=False)
+
+    Returns (info, hit). On a miss info is yt-dlp's full info dict, which can be
+    passed on to ydl.process_ie_result; on a hit it only holds METADATA_FIELDS
+    and the formats chosen by earlier callers, so downloading still needs an
+    extraction. The format ydl's 'format' option picks is recorded for it.
+    """
+    key = metadata_key(url)
+    cache = get_metadata_cache()
+    if key:
+        try:
+            cached = cache.get(key)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read the metadata cache: {e}")
+            cached = None
+        if cached is not None:
+            return cached, True
+
+    info = ydl.extract_info(url, download=False)
+    if key:
+        try:
+            cache.put(key, info, ydl.params.get('format'))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write the metadata cache: {e}")
+    return info, False
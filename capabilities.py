@@ -0,0 +1,185 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Where probed ffmpeg capabilities are kept between runs; rebuilt whenever the ffmpeg binary changes
+CAPABILITIES_CACHE = os.environ.get('SPEDUP_CAPABILITIES_CACHE', os.path.join(SCRIPT_DIR, 'ffmpeg_capabilities.json'))
+
+# Filters some features depend on, recorded so callers can check before building a graph
+TRACKED_FILTERS = ('loudnorm', 'rubberband', 'drawtext', 'asetrate', 'scale', 'fps')
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class FFmpegCapabilities:
+    """What one ffmpeg binary supports: encoders, filters, hwaccels and demuxers
+
+    Hardware encoders are only counted as usable after a tiny test encode
+    succeeds, since builds such as the gyan.dev ones list NVENC on machines
+    without an NVIDIA GPU.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.encoders = set(data.get('encoders', []))
+        self.filters = set(data.get('filters', []))
+        self.hwaccels = set(data.get('hwaccels', []))
+        self.demuxers = set(data.get('demuxers', []))
+        self.hw_encoders = set(data.get('hw_encoders', []))
+        # -fps_mode replaced -vsync in ffmpeg 5.1; older builds only know -vsync
+        self.has_fps_mode = bool(data.get('fps_mode'))
+        # False when ffmpeg could not be found or probed; callers then keep their usual settings
+        self.known = bool(self.encoders)
+
+    def has_encoder(self, name):
+        return name in self.encoders
+
+    def has_filter(self, name):
+        return name in self.filters
+
+    def has_hwaccel(self, name):
+        return name in self.hwaccels
+
+    def has_demuxer(self, name):
+        return name in self.demuxers
+
+    def can_encode(self, name):
+        """True if the encoder exists and, for a hardware encoder, actually works on this machine"""
+        if not name or name not in self.encoders:
+            return False
+        if is_hardware_encoder(name):
+            return name in self.hw_encoders
+        return True
+
+
+def is_hardware_encoder(name):
+    return any(marker in name for marker in ('_nvenc', '_qsv', '_amf', '_vaapi', '_videotoolbox'))
+
+
+def _run(ffmpeg_path, *args):
+    result = subprocess.run(
+        [ffmpeg_path, '-hide_banner', *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    return result.stdout
+
+
+def _listed_names(output):
+    """Names from an ffmpeg -encoders/-demuxers listing: the second column of every row after the dashed divider"""
+    names = []
+    in_listing = False
+    for line in output.splitlines():
+        if not in_listing:
+            in_listing = bool(line.strip()) and set(line.strip()) == {'-'}
+            continue
+        parts = line.split()
+        if len(parts) >= 2:
+            # Demuxers such as "mov,mp4,m4a,3gp" list several names at once
+            names.extend(parts[1].split(','))
+    return names
+
+
+def _filter_names(output):
+    names = []
+    for line in output.splitlines():
+        parts = line.split()
+        # Rows look like " TSC loudnorm           A->A       EBU R128 loudness normalization"
+        if len(parts) >= 3 and '->' in parts[2]:
+            names.append(parts[1])
+    return names
+
+
+def _test_encode(ffmpeg_path, encoder):
+    """Encode a fraction of a second of black video with encoder; True if it works"""
+    result = subprocess.run(
+        [ffmpeg_path, '-hide_banner', '-v', 'error', '-f', 'lavfi', '-i', 'color=c=black:s=256x256:d=0.2',
+         '-c:v', encoder, '-f', 'null', '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=30
+    )
+    return result.returncode == 0
+
+
+def probe_capabilities(ffmpeg_path):
+    """Ask an ffmpeg binary what it supports"""
+    encoders = _listed_names(_run(ffmpeg_path, '-encoders'))
+    hwaccels = [line.strip() for line in _run(ffmpeg_path, '-hwaccels').splitlines()[1:] if line.strip()]
+    hw_encoders = []
+    for encoder in encoders:
+        if is_hardware_encoder(encoder):
+            try:
+                if _test_encode(ffmpeg_path, encoder):
+                    hw_encoders.append(encoder)
+            except subprocess.TimeoutExpired:
+                pass
+    filters = _filter_names(_run(ffmpeg_path, '-filters'))
+    return {
+        'encoders': encoders,
+        'hw_encoders': hw_encoders,
+        'filters': filters,
+        'tracked_filters': {name: name in filters for name in TRACKED_FILTERS},
+        'hwaccels': hwaccels,
+        'demuxers': _listed_names(_run(ffmpeg_path, '-demuxers')),
+        'fps_mode': '-fps_mode' in _run(ffmpeg_path, '-h', 'long'),
+    }
+
+
+def _load_cache(cache_path, key):
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cache.get(key)
+
+
+def _save_cache(cache_path, key, data):
+    """Add one binary's capabilities to the cache file, replacing it atomically"""
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[key] = data
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(temp_path, cache_path)
+
+
+def get_capabilities(ffmpeg_path, cache_path=CAPABILITIES_CACHE):
+    """Capabilities of an ffmpeg binary, probed at most once per binary version
+
+    Results are kept in memory for the life of the process and in a JSON
+    cache keyed by the binary's path and mtime, so replacing ffmpeg triggers
+    a fresh probe. A missing binary reports no capabilities and is not cached.
+    """
+    resolved = ffmpeg_path if os.path.isfile(ffmpeg_path) else shutil.which(ffmpeg_path)
+    if not resolved:
+        print(f"ffmpeg not found at {ffmpeg_path}, assuming no capabilities")
+        return FFmpegCapabilities({})
+    resolved = os.path.abspath(resolved)
+    key = f'{resolved}|{os.path.getmtime(resolved)}'
+
+    with _registry_lock:
+        if key in _registry:
+            return _registry[key]
+        data = _load_cache(cache_path, key)
+        if data is None:
+            print(f"Probing capabilities of {resolved}...")
+            data = probe_capabilities(resolved)
+            try:
+                _save_cache(cache_path, key, data)
+            except OSError as e:
+                print(f"Warning: Could not write capability cache {cache_path}: {e}")
+        capabilities = FFmpegCapabilities(data)
+        _registry[key] = capabilities
+    return capabilities
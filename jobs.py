@@ -0,0 +1,450 @@
+import heapq
+import math
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from jobstore import FINISHED_STATES
+
+
+class StatusReporter:
+    """Picklable update_status callable that forwards status fields from a worker process"""
+
+    def __init__(self, updates, job_id):
+        self.updates = updates
+        self.job_id = job_id
+
+    def __call__(self, **fields):
+        self.updates.put((self.job_id, fields))
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the queue cannot take another job"""
+
+    def __init__(self, message, retry_after, estimated_wait):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.estimated_wait = estimated_wait
+
+
+class JobManager:
+    """Keeps per-job status and runs render jobs on a bounded executor
+
+    mode='thread' runs jobs on threads of this process; mode='process' runs
+    them in a pool of worker processes that report status back over a queue.
+    With a queue backend (see queues.py) nothing renders here: jobs are pushed
+    to the backend for worker.py processes, which may run on other machines,
+    and their status updates are read back from it.
+
+    Queued jobs are started shortest-job-first. cost_estimator(params) may
+    return {'estimated_cost': seconds, ...}; until it does a job counts as
+    default_cost. The queue is ordered by cost - aging * seconds waited, so a
+    long job moves up the longer it waits and is never starved. Because every
+    job ages at the same rate that equals ordering by cost + aging * enqueue
+    time, which never changes while a job waits and fits a plain heap.
+    """
+
+    # Run time assumed for a job until some have completed
+    DEFAULT_JOB_SECONDS = 120
+
+    def __init__(self, task, max_workers, store, mode='thread', initializer=None, max_queue_depth=None, max_queue_wait=None,
+                 cost_estimator=None, default_cost=240, aging=1.0, backend=None):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor mode: {mode}")
+        self.task = task
+        self.max_workers = max_workers
+        self.store = store
+        self.mode = mode
+        self.initializer = initializer
+        # Admission limits: queued jobs allowed, and the longest estimated wait a new job may face
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait = max_queue_wait
+        self._admission_lock = threading.Lock()
+        self.cost_estimator = cost_estimator
+        self.default_cost = default_cost
+        self.aging = aging
+        self._estimator_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='estimate') if cost_estimator else None
+        self.backend = backend
+        self._started = False
+        self._executor = None
+        self._mp_manager = None
+        self._updates = None
+        self._lock = threading.Lock()
+        # Job state lives in the store; these only wake watchers. One condition per job,
+        # all sharing _lock, and update() is the single producer that notifies them.
+        # Versions are stamped from one clock, so a job forgotten once it finished and
+        # watched again starts past any version a watcher saw. Entries of finished jobs
+        # are dropped once nobody waits on them.
+        self._changed = {}
+        self._versions = {}
+        self._watchers = {}
+        self._version_clock = 0
+        # Jobs waiting for a worker: heap of [sort key, sequence, job_id] entries. A job's
+        # current entry is the one in _queue_entries; older entries for it are skipped.
+        self._heap = []
+        self._queue_entries = {}
+        self._queued_params = {}
+        self._enqueued_at = {}
+        self._sequence = 0
+        self._running = 0
+        # Cancel events of running jobs
+        self._cancel_events = {}
+
+    def _get_executor(self):
+        # Started lazily so that importing the app (e.g. from a spawned child) never forks workers
+        with self._lock:
+            if self._executor is None:
+                if self.mode == 'process':
+                    if self._mp_manager is None:
+                        self._mp_manager = multiprocessing.Manager()
+                        self._updates = self._mp_manager.Queue()
+                        threading.Thread(target=self._drain_updates, daemon=True).start()
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+                    print(f"Started {self.max_workers} render worker processes")
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='render')
+            return self._executor
+
+    def submit(self, params):
+        """Queue a new job and return its ID, or raise QueueFull when over capacity"""
+        self.start()
+        with self._admission_lock:
+            stats = self.queue_stats()
+            over_depth = self.max_queue_depth is not None and stats['queued'] >= self.max_queue_depth
+            over_wait = self.max_queue_wait is not None and stats['estimated_wait'] > self.max_queue_wait
+            if over_depth or over_wait:
+                raise QueueFull('Server is busy, try again later', self._retry_after(stats), stats['estimated_wait'])
+            job_id = uuid.uuid4().hex[:12]
+            self.store.create(job_id, params)
+        self._enqueue(job_id, params)
+        return job_id
+
+    def queue_stats(self):
+        """Queue depth, running jobs, recent throughput and the wait a new job can expect"""
+        queued = self.store.count(['queued'])
+        running = self.store.count(['processing'])
+        run_times = self.store.recent_run_times()
+        average_run_time = sum(run_times) / len(run_times) if run_times else self.DEFAULT_JOB_SECONDS
+        # Jobs finished per second with every worker busy
+        throughput = self.max_workers / max(average_run_time, 1.0)
+        # A new job waits for everything ahead of it once all workers are taken
+        waiting_ahead = max(queued + running - self.max_workers + 1, 0)
+        return {
+            'queued': queued,
+            'running': running,
+            'workers': self.max_workers,
+            'average_run_time': round(average_run_time, 1),
+            'throughput_per_minute': round(throughput * 60, 2),
+            'estimated_wait': round(waiting_ahead / throughput, 1),
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+    def _retry_after(self, stats):
+        """Seconds until enough queued jobs have drained for a new one to be admitted"""
+        throughput = stats['throughput_per_minute'] / 60
+        excess = 1
+        if self.max_queue_depth is not None:
+            excess = max(excess, stats['queued'] - self.max_queue_depth + 1)
+        if self.max_queue_wait is not None:
+            excess = max(excess, math.ceil((stats['estimated_wait'] - self.max_queue_wait) * throughput))
+        return max(1, math.ceil(excess / throughput))
+
+    def start(self):
+        """Resume interrupted jobs and, with a queue backend, start reading worker status updates
+
+        Called once by the serving process; safe to call again.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        # Resumed first: with a queue backend it applies the worker updates that are waiting, which _listen would race
+        self.resume_interrupted()
+        if self.backend is not None:
+            threading.Thread(target=self._listen, daemon=True).start()
+
+    def resume_interrupted(self):
+        """Re-enqueue jobs that were queued or running when the server last stopped"""
+        if self.backend is not None:
+            # Remote workers keep running while the web app restarts. What they reported meanwhile is applied
+            # first, so jobs they claimed or finished are no longer 'queued'; only waiting jobs are re-pushed,
+            # and a running job whose worker died comes back through the backend once its claim lease expires
+            self._apply_pending_status()
+            interrupted = self.store.requeue_interrupted(states=('queued',))
+        else:
+            interrupted = self.store.requeue_interrupted()
+        for job_id, params in interrupted:
+            self._enqueue(job_id, params, restored=True)
+        if interrupted:
+            print(f"Re-queued {len(interrupted)} interrupted job(s)")
+        return len(interrupted)
+
+    def _enqueue(self, job_id, params, restored=False):
+        enqueued_at = self.store.get(job_id)['created_at']
+        if self.backend is not None:
+            sort_key = self._sort_key(self.default_cost, enqueued_at)
+            if not restored:
+                self.backend.push(job_id, params, sort_key)
+            elif not self.backend.restore(job_id, params, sort_key):
+                # Still waiting in the backend, or a worker has it; nothing to re-push or estimate
+                return
+        else:
+            with self._lock:
+                self._queued_params[job_id] = params
+                self._enqueued_at[job_id] = enqueued_at
+                self._push(job_id, self.default_cost)
+        self._dispatch()
+        # Only a job that has to wait needs a cost to be ordered by; one that started at once is left alone
+        if self._estimator_pool is not None and self._is_waiting(job_id):
+            self._estimator_pool.submit(self._estimate, job_id, params)
+
+    def _is_waiting(self, job_id):
+        if self.backend is not None:
+            # Remote workers claim jobs on their own; a job waits once more are queued or running than there are workers
+            return self.store.count(['queued', 'processing']) > self.max_workers
+        with self._lock:
+            return job_id in self._queue_entries
+
+    def _sort_key(self, cost, enqueued_at):
+        return cost + self.aging * enqueued_at
+
+    def _push(self, job_id, cost):
+        # Caller holds _lock; replaces any earlier entry of the job
+        self._sequence += 1
+        entry = [self._sort_key(cost, self._enqueued_at[job_id]), self._sequence, job_id]
+        self._queue_entries[job_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _pop(self):
+        # Caller holds _lock; returns the queued job with the lowest key, or None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            job_id = entry[2]
+            if self._queue_entries.get(job_id) is entry:
+                del self._queue_entries[job_id]
+                del self._enqueued_at[job_id]
+                return job_id
+        return None
+
+    def _estimate(self, job_id, params):
+        """Work out a queued job's cost and move it to its place in the queue"""
+        try:
+            estimate = self.cost_estimator(params)
+        except Exception as e:
+            print(f"Could not estimate cost of job {job_id}: {e}")
+            return
+        if not estimate:
+            return
+        self.update(job_id, **estimate)
+        if self.backend is not None:
+            job = self.store.get(job_id)
+            self.backend.reprioritize(job_id, self._sort_key(estimate['estimated_cost'], job['created_at']))
+            return
+        with self._lock:
+            if job_id in self._queue_entries:
+                self._push(job_id, estimate['estimated_cost'])
+
+    def _dispatch(self):
+        """Start queued jobs while workers are free"""
+        if self.backend is not None:
+            return
+        while True:
+            with self._lock:
+                if self._running >= self.max_workers:
+                    return
+                job_id = self._pop()
+                if job_id is None:
+                    return
+                params = self._queued_params.pop(job_id)
+                self._running += 1
+            self._start(job_id, params)
+
+    def _reset_executor(self, executor):
+        """Drop a process pool that broke because a worker died; the next job starts a fresh one"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        print("A render worker process died, restarting the worker pool")
+        executor.shutdown(wait=False)
+
+    def _start(self, job_id, params):
+        # A dead worker leaves the pool broken, and every submit to it fails; retry once on a fresh pool
+        for attempt in range(2):
+            try:
+                executor = self._get_executor()
+                self._submit(executor, job_id, params)
+                return
+            except BrokenProcessPool:
+                self._reset_executor(executor)
+                error = 'the render worker pool broke'
+            except Exception as e:
+                error = str(e)
+                break
+        with self._lock:
+            self._cancel_events.pop(job_id, None)
+            self._running -= 1
+        self.update(job_id, status='error', message=f'Error creating video: could not start the job ({error})')
+        print(f"Could not start job {job_id}: {error}")
+
+    def _submit(self, executor, job_id, params):
+        if self.mode == 'process':
+            # Manager events can be pickled into the worker and set from here
+            cancel_event = self._mp_manager.Event()
+            update_status = StatusReporter(self._updates, job_id)
+            future = executor.submit(self.task, update_status, cancel_event=cancel_event, **params)
+        else:
+            cancel_event = threading.Event()
+            future = executor.submit(self._run, job_id, params, cancel_event)
+        with self._lock:
+            self._cancel_events[job_id] = cancel_event
+        future.add_done_callback(lambda f: self._on_done(job_id, f, executor))
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job
+
+        A queued job is dropped before it starts. A running job has its cancel
+        event set, which kills its ffmpeg/yt-dlp work; the job then cleans up its
+        workspace and reports 'cancelled'. Returns False if the job was not active.
+        """
+        if self.backend is not None:
+            return self._cancel_remote(job_id)
+        with self._lock:
+            was_queued = self._queue_entries.pop(job_id, None) is not None
+            if was_queued:
+                del self._queued_params[job_id]
+                del self._enqueued_at[job_id]
+            cancel_event = self._cancel_events.get(job_id)
+        if was_queued:
+            self.update(job_id, status='cancelled', message='Job cancelled')
+        elif cancel_event is not None:
+            cancel_event.set()
+            self.update(job_id, message='Cancelling...')
+        else:
+            return False
+        return True
+
+    def _cancel_remote(self, job_id):
+        job = self.store.get(job_id)
+        if job is None or job['status'] in FINISHED_STATES:
+            return False
+        if self.backend.remove(job_id):
+            self.update(job_id, status='cancelled', message='Job cancelled')
+        else:
+            # A worker already has it; the worker polls for this flag and kills its ffmpeg/yt-dlp work
+            self.backend.request_cancel(job_id)
+            self.update(job_id, message='Cancelling...')
+        return True
+
+    def get(self, job_id):
+        """Return a job's record from the store, or None if the ID is unknown"""
+        return self.store.get(job_id)
+
+    def latest(self):
+        """Return the most recently submitted job"""
+        return self.store.latest()
+
+    def list(self, states=None, limit=100):
+        return self.store.list(states, limit)
+
+    def update(self, job_id, **fields):
+        """Write status fields to the store and wake anyone watching the job"""
+        if not self.store.update(job_id, **fields):
+            return
+        with self._lock:
+            self._version_clock += 1
+            if fields.get('status') in FINISHED_STATES and not self._watchers.get(job_id):
+                self._forget(job_id)
+                return
+            self._versions[job_id] = self._version_clock
+            if job_id in self._changed:
+                self._changed[job_id].notify_all()
+
+    def wait_for_update(self, job_id, last_version, timeout=None):
+        """Block until a job's status moves past last_version or the timeout expires
+
+        Returns (snapshot, version); the version is unchanged when the wait timed out.
+        """
+        with self._lock:
+            changed = self._changed.setdefault(job_id, threading.Condition(self._lock))
+            version = self._versions.setdefault(job_id, self._version_clock)
+            self._watchers[job_id] = self._watchers.get(job_id, 0) + 1
+            try:
+                if version == last_version:
+                    changed.wait_for(lambda: self._versions[job_id] != last_version, timeout)
+                version = self._versions[job_id]
+            finally:
+                self._watchers[job_id] -= 1
+                if not self._watchers[job_id]:
+                    del self._watchers[job_id]
+        job = self.store.get(job_id)
+        if job is None or job['status'] in FINISHED_STATES:
+            with self._lock:
+                if not self._watchers.get(job_id):
+                    self._forget(job_id)
+        return job, version
+
+    def _forget(self, job_id):
+        # Caller holds _lock; drops the wake-up state of a job nobody is waiting on
+        self._changed.pop(job_id, None)
+        self._versions.pop(job_id, None)
+        self._watchers.pop(job_id, None)
+
+    def _run(self, job_id, params, cancel_event):
+        def update_status(**fields):
+            self.update(job_id, **fields)
+
+        self.task(update_status, cancel_event=cancel_event, **params)
+
+    def _on_done(self, job_id, future, executor=None):
+        with self._lock:
+            self._cancel_events.pop(job_id, None)
+            self._running -= 1
+        # process_video_task reports its own errors; this only catches the unexpected ones,
+        # such as a worker process dying mid-job
+        e = future.exception()
+        if e is not None:
+            self.update(job_id, status='error', message=f'Error creating video: {str(e)}')
+            print(f"Unhandled error in job {job_id}: {e}")
+        if isinstance(e, BrokenProcessPool) and executor is not None:
+            self._reset_executor(executor)
+        self._dispatch()
+
+    def _listen(self):
+        """Apply status updates published by remote workers"""
+        while True:
+            try:
+                # Release the claims of dead workers even while every live worker is busy
+                self.backend.requeue_expired()
+                events = self.backend.consume_status(timeout=1)
+            except Exception as e:
+                print(f"Error reading worker status updates: {e}")
+                time.sleep(1)
+                continue
+            for job_id, fields in events:
+                self.update(job_id, **fields)
+
+    def _apply_pending_status(self):
+        """Apply every status update remote workers have published so far"""
+        while True:
+            events = self.backend.consume_status(timeout=0)
+            if not events:
+                return
+            for job_id, fields in events:
+                self.update(job_id, **fields)
+
+    def _drain_updates(self):
+        """Apply status updates sent by worker processes"""
+        while True:
+            try:
+                job_id, fields = self._updates.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                # The manager process went away, which only happens at shutdown
+                return
+            self.update(job_id, **fields)
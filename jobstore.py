@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Columns a status update may set directly; any other field is kept in the stats JSON column
+STATUS_COLUMNS = ('status', 'progress', 'message', 'output_file', 'error', 'stage', 'speed', 'eta')
+
+# A job in one of these states has finished and will not change again
+FINISHED_STATES = ('complete', 'error', 'cancelled')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    output_file TEXT,
+    error TEXT,
+    stage TEXT,
+    stage_started_at REAL,
+    stage_timings TEXT NOT NULL DEFAULT '{}',
+    speed REAL,
+    eta REAL,
+    stats TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+"""
+
+
+class JobStore:
+    """Durable job records in an embedded SQLite database
+
+    Each record holds the job's parameters, state, per-stage timings, output
+    path and error, so jobs and their history survive a restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL lets readers (status requests) proceed while a job is writing progress
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def create(self, job_id, params):
+        """Insert a new queued job and return its record"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, params, status, message, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, json.dumps(params), 'queued', 'Waiting in queue...', now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Return a job record as a dict, or None if the ID is unknown"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def latest(self):
+        """Return the most recently created job"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT 1').fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, states=None, limit=100):
+        """Return the newest jobs, optionally only those in the given states"""
+        query = 'SELECT * FROM jobs'
+        args = []
+        if states:
+            query += f' WHERE status IN ({",".join("?" * len(states))})'
+            args.extend(states)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count(self, states):
+        """Number of jobs currently in any of the given states"""
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT COUNT(*) FROM jobs WHERE status IN ({",".join("?" * len(states))})', list(states)
+            ).fetchone()
+        return row[0]
+
+    def recent_run_times(self, limit=20):
+        """Wall-clock run times in seconds of the most recently completed jobs"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT finished_at - started_at FROM jobs WHERE status = 'complete' AND started_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def update(self, job_id, **fields):
+        """Apply a status update; returns False if the job does not exist or has finished
+
+        A change of 'stage' closes the timing of the previous stage, and a
+        finished status closes the last one.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, stage, stage_started_at, stage_timings, stats FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if row is None or row['status'] in FINISHED_STATES:
+                return False
+
+            columns = {'updated_at': now}
+            stats = json.loads(row['stats'])
+            for key, value in fields.items():
+                if key in STATUS_COLUMNS:
+                    columns[key] = value
+                else:
+                    stats[key] = value
+            columns['stats'] = json.dumps(stats)
+
+            status = fields.get('status')
+            if status == 'processing' and row['status'] == 'queued':
+                columns['started_at'] = now
+            if status == 'error' and 'error' not in fields:
+                columns['error'] = fields.get('message')
+
+            new_stage = fields.get('stage', row['stage'])
+            finished = status in FINISHED_STATES
+            if row['stage'] and (new_stage != row['stage'] or finished):
+                timings = json.loads(row['stage_timings'])
+                timings[row['stage']] = round(timings.get(row['stage'], 0) + now - row['stage_started_at'], 3)
+                columns['stage_timings'] = json.dumps(timings)
+            if finished:
+                columns['finished_at'] = now
+                columns['stage'] = None
+                columns['stage_started_at'] = None
+            elif new_stage != row['stage']:
+                columns['stage_started_at'] = now
+
+            assignments = ', '.join(f'{column} = ?' for column in columns)
+            self._conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*columns.values(), job_id))
+        return True
+
+    def requeue_interrupted(self, states=('queued', 'processing')):
+        """Mark jobs that were in the given states when the process stopped as queued again
+
+        Returns the (job_id, params) pairs that need to be re-enqueued, oldest first.
+        """
+        now = time.time()
+        placeholders = ','.join('?' * len(states))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT id, params FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at', list(states)
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', progress = 0, message = 'Re-queued after restart', "
+                "stage = NULL, stage_started_at = NULL, speed = NULL, eta = NULL, started_at = NULL, updated_at = ? "
+                f"WHERE status IN ({placeholders})",
+                (now, *states)
+            )
+        return [(row['id'], json.loads(row['params'])) for row in rows]
+
+    def _to_dict(self, row):
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['stage_timings'] = json.loads(job['stage_timings'])
+        job['stats'] = json.loads(job['stats'])
+        del job['stage_started_at']
+        return job
@@ -5,34 +5,18 @@ import re
 import subprocess
 import random
 import shlex
-import platform
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from capabilities import get_capabilities
+from caches import cached_extract_info
 
 def check_nvidia_gpu():
     """Check if NVIDIA GPU with NVENC support is available."""
-    try:
-        # Check if nvidia-smi is available
-        if platform.system() == "Windows":
-            result = subprocess.run(['where', 'nvidia-smi'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if result.returncode != 0:
-                return False
-        else:  # Linux/Mac
-            result = subprocess.run(['which', 'nvidia-smi'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if result.returncode != 0:
-                return False
-        
-        # Check if nvidia-smi can be executed
-        result = subprocess.run(['nvidia-smi'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode != 0:
-            return False
-            
-        # Check if ffmpeg supports nvenc
-        result = subprocess.run(['ffmpeg', '-encoders'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if b'h264_nvenc' not in result.stdout:
-            return False
-            
-        return True
-    except:
-        return False
+    # The shared capability registry test-encodes NVENC once and caches the result per ffmpeg binary,
+    # which also covers builds that list h264_nvenc on machines without a usable GPU
+    capabilities = get_capabilities('ffmpeg')
+    return capabilities.can_encode('h264_nvenc') and capabilities.has_hwaccel('cuda')
 
 # Add function to optimize hardware acceleration parameters based on GPU
 def get_optimal_hw_params():
@@ -571,7 +555,8 @@ def modify_audio_speed(input_audio, output_audio, pitch=1.4, slow_down=False):
     os.system(command)
 
 def process_single_video(video_url, api_choice, speed_up, search_query):
-    video_info = yt_dlp.YoutubeDL().extract_info(video_url, download=False)
+    # Batches often repeat tracks; their titles come from the metadata cache shared with the web app
+    video_info, _ = cached_extract_info(yt_dlp.YoutubeDL(), video_url)
     
     if speed_up:
         video_title = "nightcore_" + re.sub(r'[\\/:*?"<>|]', '', video_info['title'].replace(" ", "_"))
@@ -0,0 +1,127 @@
+import os
+
+# Named output profiles a job can ask for. Each one sets:
+#   height        - output height in pixels, width follows the aspect ratio (None keeps the source size)
+#   codec         - software video encoder, with codec_name as ffprobe reports it (None renders audio only)
+#   preset, crf   - speed/size trade-off and constant-quality rate control of the software encoder
+#   hw_codec      - NVENC encoder used instead when a GPU is available (None always encodes in software)
+#   hw_bitrate    - target bitrate for the NVENC encoder
+#   tag           - optional codec tag for the MP4, e.g. hvc1 so Apple players accept HEVC
+#   audio_bitrate - AAC bitrate
+OUTPUT_PROFILES = {
+    'default': {
+        'description': 'Source resolution, H.264',
+        'height': None,
+        'codec': 'libx264',
+        'codec_name': 'h264',
+        'preset': 'fast',
+        'crf': 22,
+        'hw_codec': 'h264_nvenc',
+        'hw_bitrate': '5M',
+        'audio_bitrate': '192k',
+    },
+    'fast-720p': {
+        'description': '720p H.264, quickest to encode',
+        'height': 720,
+        'codec': 'libx264',
+        'codec_name': 'h264',
+        'preset': 'veryfast',
+        'crf': 23,
+        'hw_codec': 'h264_nvenc',
+        'hw_bitrate': '3M',
+        'audio_bitrate': '160k',
+    },
+    'archive-1080p': {
+        'description': '1080p H.264 at high quality, slow to encode',
+        'height': 1080,
+        'codec': 'libx264',
+        'codec_name': 'h264',
+        'preset': 'slow',
+        'crf': 18,
+        'hw_codec': 'h264_nvenc',
+        'hw_bitrate': '10M',
+        'audio_bitrate': '320k',
+    },
+    'small-hevc': {
+        'description': '720p HEVC, about half the size of H.264',
+        'height': 720,
+        'codec': 'libx265',
+        'codec_name': 'hevc',
+        'preset': 'medium',
+        'crf': 28,
+        'hw_codec': 'hevc_nvenc',
+        'hw_bitrate': '1500k',
+        'tag': 'hvc1',
+        'audio_bitrate': '128k',
+    },
+    'av1-svt': {
+        'description': 'Source resolution AV1 (SVT-AV1), smallest files',
+        'height': None,
+        'codec': 'libsvtav1',
+        'codec_name': 'av1',
+        'preset': 8,
+        'crf': 35,
+        'hw_codec': None,
+        'hw_bitrate': None,
+        'audio_bitrate': '128k',
+    },
+    'audio-only': {
+        'description': 'Sped up / slowed audio only, no video',
+        'height': None,
+        'codec': None,
+        'codec_name': None,
+        'preset': None,
+        'crf': None,
+        'hw_codec': None,
+        'hw_bitrate': None,
+        'audio_bitrate': '192k',
+    },
+}
+
+# Profile used by jobs that do not ask for one
+DEFAULT_PROFILE = os.environ.get('SPEDUP_PROFILE', 'default')
+
+
+def get_profile(name=None):
+    """Return a copy of the output profile called name, or of the default profile"""
+    name = name or DEFAULT_PROFILE
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile: {name}")
+    return dict(OUTPUT_PROFILES[name], name=name)
+
+
+def resolve_profile(profile, capabilities):
+    """Adapt a profile to what the local ffmpeg can do (see capabilities.get_capabilities)
+
+    The NVENC codec is dropped unless a test encode worked on this machine, and
+    a software codec missing from the build is swapped for the default
+    profile's, so the same job always renders the same way on the same machine.
+    """
+    profile = dict(profile)
+    if not capabilities.can_encode(profile['hw_codec']):
+        profile['hw_codec'] = None
+    if profile['codec'] and capabilities.known and not capabilities.has_encoder(profile['codec']):
+        fallback = OUTPUT_PROFILES['default']
+        print(f"{profile['codec']} is not available in this ffmpeg build, encoding {profile['name']} with {fallback['codec']}")
+        for key in ('codec', 'codec_name', 'preset', 'crf'):
+            profile[key] = fallback[key]
+        profile.pop('tag', None)
+    return profile
+
+
+def scale_filter(profile):
+    """Scale filter for a profile; dimensions stay even, as the encoders require"""
+    if profile['height']:
+        return f"scale=-2:{profile['height']}"
+    return "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+
+
+def video_codec_args(profile, threads, hw=False):
+    """ffmpeg video encoder arguments for a profile; hw picks its NVENC encoder when it has one"""
+    if hw and profile['hw_codec']:
+        args = f"-c:v {profile['hw_codec']} -preset p4 -tune hq -b:v {profile['hw_bitrate']}"
+    else:
+        args = f"-c:v {profile['codec']} -threads {threads} -preset {profile['preset']} -crf {profile['crf']}"
+    if profile.get('tag'):
+        args += f" -tag:v {profile['tag']}"
+    return args
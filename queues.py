@@ -0,0 +1,463 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Which backend carries jobs from the web app to render workers: '' keeps rendering in the web process
+QUEUE_BACKEND = os.environ.get('SPEDUP_QUEUE_BACKEND', '')
+# Spool database for the 'sqlite' backend; every process on the host must see the same file
+QUEUE_PATH = os.environ.get('SPEDUP_QUEUE_PATH', os.path.join(SCRIPT_DIR, 'queue.db'))
+# Server for the 'redis' backend, e.g. redis://:password@host:6379/0
+REDIS_URL = os.environ.get('SPEDUP_REDIS_URL', 'redis://localhost:6379/0')
+
+# How long a cancel request is remembered for a job a worker has not picked up yet
+CANCEL_TTL_SECONDS = 24 * 60 * 60
+# How long a finished job is remembered, so a restarted web app never queues it again
+ACKED_TTL_SECONDS = 24 * 60 * 60
+# A claimed job goes back to the queue once its worker has not renewed the claim for this long
+CLAIM_LEASE_SECONDS = float(os.environ.get('SPEDUP_CLAIM_LEASE_SECONDS', 60))
+
+# Status event sent to the web app for a job whose worker shut down or stopped renewing its claim
+REQUEUED_FIELDS = {
+    'status': 'queued', 'progress': 0, 'message': 'Re-queued after its worker stopped',
+    'stage': None, 'speed': None, 'eta': None,
+}
+# Status event for a claimed job whose parameters are gone, so it does not stay queued forever
+LOST_FIELDS = {'status': 'error', 'message': 'Error creating video: the job was lost from the queue', 'speed': None, 'eta': None}
+
+
+class SQLiteQueue:
+    """Job queue, cancel flags and worker status events in a shared SQLite spool file
+
+    Suits a web app and workers on the same host. Jobs are claimed lowest sort
+    key first inside an IMMEDIATE transaction, so two workers never claim the
+    same job. A claim is a lease the worker renews while it renders; an expired
+    one is released so another worker picks the job up again. Status events
+    flow back to the single web app in insertion order.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS queue (
+        job_id TEXT PRIMARY KEY,
+        params TEXT NOT NULL,
+        sort_key REAL NOT NULL,
+        claimed_by TEXT,
+        claimed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_queue_order ON queue (claimed_by, sort_key);
+    CREATE TABLE IF NOT EXISTS cancels (
+        job_id TEXT PRIMARY KEY,
+        requested_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS acked (
+        job_id TEXT PRIMARY KEY,
+        acked_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT NOT NULL,
+        fields TEXT NOT NULL
+    );
+    """
+
+    # How often blocking calls look at the spool again
+    POLL_SECONDS = 0.25
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self.SCHEMA)
+
+    def push(self, job_id, params, sort_key):
+        """Add a job, or reset its place if it is already queued"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO queue (job_id, params, sort_key) VALUES (?, ?, ?)',
+                (job_id, json.dumps(params), sort_key)
+            )
+
+    def restore(self, job_id, params, sort_key):
+        """Add a job again after a web app restart, unless it is still here or a worker already finished it
+
+        Returns True if the job was added.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self._conn.execute('SELECT 1 FROM acked WHERE job_id = ?', (job_id,)).fetchone():
+                    added = False
+                else:
+                    cursor = self._conn.execute(
+                        'INSERT OR IGNORE INTO queue (job_id, params, sort_key) VALUES (?, ?, ?)',
+                        (job_id, json.dumps(params), sort_key)
+                    )
+                    added = cursor.rowcount > 0
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return added
+
+    def reprioritize(self, job_id, sort_key):
+        """Move a job that is still waiting to a new place in the queue"""
+        with self._lock:
+            self._conn.execute('UPDATE queue SET sort_key = ? WHERE job_id = ? AND claimed_by IS NULL', (sort_key, job_id))
+
+    def pop(self, worker_id, timeout):
+        """Claim the waiting job with the lowest sort key; returns (job_id, params) or None after timeout"""
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self._release_expired()
+                    row = self._conn.execute(
+                        'SELECT job_id, params FROM queue WHERE claimed_by IS NULL ORDER BY sort_key LIMIT 1'
+                    ).fetchone()
+                    if row:
+                        self._conn.execute(
+                            'UPDATE queue SET claimed_by = ?, claimed_at = ? WHERE job_id = ?', (worker_id, time.time(), row[0])
+                        )
+                    self._conn.execute('COMMIT')
+                except Exception:
+                    self._conn.execute('ROLLBACK')
+                    raise
+            if row:
+                return row[0], json.loads(row[1])
+            if time.time() >= deadline:
+                return None
+            time.sleep(self.POLL_SECONDS)
+
+    def renew(self, job_id):
+        """Extend the claim on a job the worker is still rendering"""
+        with self._lock:
+            self._conn.execute('UPDATE queue SET claimed_at = ? WHERE job_id = ? AND claimed_by IS NOT NULL', (time.time(), job_id))
+
+    def requeue_expired(self):
+        """Release claims whose lease ran out and tell the web app; returns the re-queued job ids"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                requeued = self._release_expired()
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return requeued
+
+    def release(self, job_id, worker_id):
+        """Hand a claimed job back to the queue unfinished, e.g. when its worker shuts down"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self._conn.execute(
+                    'UPDATE queue SET claimed_by = NULL, claimed_at = NULL WHERE job_id = ? AND claimed_by = ?', (job_id, worker_id)
+                )
+                if cursor.rowcount:
+                    self._conn.execute('INSERT INTO events (job_id, fields) VALUES (?, ?)', (job_id, json.dumps(REQUEUED_FIELDS)))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _release_expired(self):
+        # Runs inside the caller's IMMEDIATE transaction
+        rows = self._conn.execute(
+            'SELECT job_id FROM queue WHERE claimed_by IS NOT NULL AND claimed_at < ?', (time.time() - CLAIM_LEASE_SECONDS,)
+        ).fetchall()
+        for (job_id,) in rows:
+            self._conn.execute('UPDATE queue SET claimed_by = NULL, claimed_at = NULL WHERE job_id = ?', (job_id,))
+            self._conn.execute('INSERT INTO events (job_id, fields) VALUES (?, ?)', (job_id, json.dumps(REQUEUED_FIELDS)))
+        return [job_id for (job_id,) in rows]
+
+    def remove(self, job_id):
+        """Drop a job no worker has claimed yet; returns True if it was removed"""
+        self.requeue_expired()
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM queue WHERE job_id = ? AND claimed_by IS NULL', (job_id,))
+        return cursor.rowcount > 0
+
+    def ack(self, job_id, worker_id):
+        """Forget a job once worker_id has finished with it
+
+        A worker whose claim expired and was taken over by another leaves the
+        job to that worker.
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM queue WHERE job_id = ? AND (claimed_by = ? OR claimed_by IS NULL)', (job_id, worker_id))
+            if self._conn.execute('SELECT 1 FROM queue WHERE job_id = ?', (job_id,)).fetchone() is None:
+                self._conn.execute('DELETE FROM cancels WHERE job_id = ?', (job_id,))
+            self._conn.execute('INSERT OR REPLACE INTO acked (job_id, acked_at) VALUES (?, ?)', (job_id, time.time()))
+            self._conn.execute('DELETE FROM acked WHERE acked_at < ?', (time.time() - ACKED_TTL_SECONDS,))
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO cancels (job_id, requested_at) VALUES (?, ?)', (job_id, time.time()))
+            self._conn.execute('DELETE FROM cancels WHERE requested_at < ?', (time.time() - CANCEL_TTL_SECONDS,))
+
+    def is_cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM cancels WHERE job_id = ?', (job_id,)).fetchone()
+        return row is not None
+
+    def publish_status(self, job_id, fields):
+        """Send a status update from a worker to the web app"""
+        with self._lock:
+            self._conn.execute('INSERT INTO events (job_id, fields) VALUES (?, ?)', (job_id, json.dumps(fields)))
+
+    def consume_status(self, timeout):
+        """Take the pending status updates as (job_id, fields) pairs, waiting up to timeout for the first"""
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                rows = self._conn.execute('SELECT id, job_id, fields FROM events ORDER BY id LIMIT 500').fetchall()
+                if rows:
+                    self._conn.execute('DELETE FROM events WHERE id <= ?', (rows[-1][0],))
+            if rows:
+                return [(job_id, json.loads(fields)) for _, job_id, fields in rows]
+            if time.time() >= deadline:
+                return []
+            time.sleep(self.POLL_SECONDS)
+
+
+class RedisError(Exception):
+    """Error reply from the Redis server"""
+
+
+class RedisConnection:
+    """Minimal client for the Redis protocol (RESP2), enough for the queue commands used here"""
+
+    def __init__(self, host, port, db=0, password=None):
+        self._sock = socket.create_connection((host, port))
+        self._file = self._sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    def execute(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def close(self):
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis server closed the connection")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest.decode()
+        if prefix == b'-':
+            raise RedisError(rest.decode())
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            return self._file.read(length + 2)[:-2].decode()
+        if prefix == b'*':
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis: {line!r}")
+
+
+class RedisQueue:
+    """Job queue, cancel flags and worker status events on a Redis server
+
+    Lets web apps and workers run on different machines. Waiting jobs sit in a
+    sorted set scored by sort key and are claimed with BZPOPMIN into a second
+    sorted set scored by lease deadline, which the worker pushes back while it
+    renders; expired claims return to the queue with their sort key. Status
+    events go through a list, and cancel requests and finished-job markers are
+    keys with a TTL. Each thread gets its own connection because BZPOPMIN and
+    BLPOP block it.
+    """
+
+    def __init__(self, url, prefix='spedup'):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.password = parsed.password
+        self.queue_key = f'{prefix}:queue'
+        self.claims_key = f'{prefix}:claims'
+        self.owners_key = f'{prefix}:owners'
+        self.params_key = f'{prefix}:params'
+        self.sort_keys_key = f'{prefix}:sort_keys'
+        self.events_key = f'{prefix}:events'
+        self.cancel_prefix = f'{prefix}:cancel:'
+        self.acked_prefix = f'{prefix}:acked:'
+        self._local = threading.local()
+
+    def _execute(self, *args):
+        # Reconnect once if the server dropped an idle connection
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = RedisConnection(self.host, self.port, self.db, self.password)
+                self._local.connection = connection
+            try:
+                return connection.execute(*args)
+            except (ConnectionError, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def push(self, job_id, params, sort_key):
+        """Add a job, or reset its place if it is already queued"""
+        self._execute('HSET', self.params_key, job_id, json.dumps(params))
+        self._execute('HSET', self.sort_keys_key, job_id, sort_key)
+        self._execute('ZADD', self.queue_key, sort_key, job_id)
+
+    def restore(self, job_id, params, sort_key):
+        """Add a job again after a web app restart, unless it is still here or a worker already finished it
+
+        Returns True if the job was added.
+        """
+        self._execute('HSETNX', self.params_key, job_id, json.dumps(params))
+        self._execute('HSETNX', self.sort_keys_key, job_id, sort_key)
+        if not self._execute('ZADD', self.queue_key, 'NX', sort_key, job_id):
+            return False
+        # Checked after adding: a worker that claims or acks the job meanwhile is seen here, or removes it in pop
+        if self._execute('EXISTS', self.acked_prefix + job_id):
+            self._execute('ZREM', self.queue_key, job_id)
+            self._execute('HDEL', self.params_key, job_id)
+            self._execute('HDEL', self.sort_keys_key, job_id)
+            return False
+        if self._execute('ZSCORE', self.claims_key, job_id) is not None:
+            self._execute('ZREM', self.queue_key, job_id)
+            return False
+        return True
+
+    def reprioritize(self, job_id, sort_key):
+        """Move a job that is still waiting to a new place in the queue"""
+        if self._execute('ZSCORE', self.queue_key, job_id) is not None:
+            self._execute('HSET', self.sort_keys_key, job_id, sort_key)
+            self._execute('ZADD', self.queue_key, 'XX', sort_key, job_id)
+
+    def pop(self, worker_id, timeout):
+        """Claim the waiting job with the lowest sort key; returns (job_id, params) or None after timeout"""
+        self.requeue_expired()
+        reply = self._execute('BZPOPMIN', self.queue_key, max(1, int(timeout)))
+        if not reply:
+            return None
+        job_id = reply[1]
+        self._execute('ZADD', self.claims_key, time.time() + CLAIM_LEASE_SECONDS, job_id)
+        self._execute('HSET', self.owners_key, job_id, worker_id)
+        # A restore racing this claim may have put the job back; the claim wins
+        self._execute('ZREM', self.queue_key, job_id)
+        params = self._execute('HGET', self.params_key, job_id)
+        if params is None:
+            self._execute('ZREM', self.claims_key, job_id)
+            self._execute('HDEL', self.owners_key, job_id)
+            # Acked by a worker whose claim had expired, so it is done; otherwise tell the web app it is gone
+            if not self._execute('EXISTS', self.acked_prefix + job_id):
+                self.publish_status(job_id, LOST_FIELDS)
+            return None
+        return job_id, json.loads(params)
+
+    def renew(self, job_id):
+        """Extend the claim on a job the worker is still rendering"""
+        self._execute('ZADD', self.claims_key, 'XX', time.time() + CLAIM_LEASE_SECONDS, job_id)
+
+    def release(self, job_id, worker_id):
+        """Hand a claimed job back to the queue unfinished, e.g. when its worker shuts down"""
+        if self._execute('HGET', self.owners_key, job_id) == worker_id:
+            self._requeue(job_id)
+
+    def requeue_expired(self):
+        """Release claims whose lease ran out and tell the web app; returns the re-queued job ids"""
+        expired = self._execute('ZRANGEBYSCORE', self.claims_key, '-inf', time.time())
+        return [job_id for job_id in expired if self._requeue(job_id)]
+
+    def _requeue(self, job_id):
+        # Only the caller whose ZREM succeeds puts the job back, so it is re-queued once
+        if not self._execute('ZREM', self.claims_key, job_id):
+            return False
+        self._execute('HDEL', self.owners_key, job_id)
+        sort_key = self._execute('HGET', self.sort_keys_key, job_id)
+        if sort_key is None:
+            return False
+        self._execute('ZADD', self.queue_key, sort_key, job_id)
+        self.publish_status(job_id, REQUEUED_FIELDS)
+        return True
+
+    def remove(self, job_id):
+        """Drop a job no worker has claimed yet; returns True if it was removed"""
+        self.requeue_expired()
+        removed = self._execute('ZREM', self.queue_key, job_id) > 0
+        if removed:
+            self._execute('HDEL', self.params_key, job_id)
+            self._execute('HDEL', self.sort_keys_key, job_id)
+        return removed
+
+    def ack(self, job_id, worker_id):
+        """Forget a job once worker_id has finished with it
+
+        A worker whose claim expired keeps its hands off the job if another
+        worker has claimed it since; a re-queued copy nobody took is dropped.
+        """
+        self._execute('SET', self.acked_prefix + job_id, 1, 'EX', ACKED_TTL_SECONDS)
+        if self._execute('HGET', self.owners_key, job_id) != worker_id and not self._execute('ZREM', self.queue_key, job_id):
+            return
+        self._execute('ZREM', self.claims_key, job_id)
+        self._execute('ZREM', self.queue_key, job_id)
+        self._execute('HDEL', self.owners_key, job_id)
+        self._execute('HDEL', self.params_key, job_id)
+        self._execute('HDEL', self.sort_keys_key, job_id)
+        self._execute('DEL', self.cancel_prefix + job_id)
+
+    def request_cancel(self, job_id):
+        self._execute('SET', self.cancel_prefix + job_id, 1, 'EX', CANCEL_TTL_SECONDS)
+
+    def is_cancel_requested(self, job_id):
+        return self._execute('EXISTS', self.cancel_prefix + job_id) > 0
+
+    def publish_status(self, job_id, fields):
+        """Send a status update from a worker to the web app"""
+        self._execute('RPUSH', self.events_key, json.dumps([job_id, fields]))
+
+    def consume_status(self, timeout):
+        """Take the pending status updates as (job_id, fields) pairs, waiting up to timeout for the first"""
+        reply = self._execute('BLPOP', self.events_key, max(1, int(timeout)))
+        if not reply:
+            return []
+        events = [json.loads(reply[1])]
+        # Drain whatever else is already waiting without blocking again
+        while len(events) < 500:
+            event = self._execute('LPOP', self.events_key)
+            if event is None:
+                break
+            events.append(json.loads(event))
+        return [(job_id, fields) for job_id, fields in events]
+
+
+def open_queue_backend(name=QUEUE_BACKEND):
+    """Return the queue backend called name, or None to render inside the web process"""
+    if not name:
+        return None
+    if name == 'sqlite':
+        return SQLiteQueue(QUEUE_PATH)
+    if name == 'redis':
+        return RedisQueue(REDIS_URL)
+    raise ValueError(f"Unknown queue backend: {name}")
@@ -0,0 +1,1047 @@
+import subprocess
+import json
+import math
+import os
+import yt_dlp
+import re
+import requests
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from caches import cached_extract_info, file_sha256, get_processed_audio_cache, get_source_audio_cache, metadata_key
+from capabilities import get_capabilities
+from profiles import get_profile, resolve_profile, scale_filter, video_codec_args
+
+# Get the directory where the script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Define paths to FFmpeg executables
+FFMPEG_PATH = os.path.join(SCRIPT_DIR, "ffmpeg.exe")
+FFPROBE_PATH = os.path.join(SCRIPT_DIR, "ffprobe.exe")
+
+# Finished videos; with workers on several machines this must be storage the web app can read too
+OUTPUT_DIR = os.environ.get('SPEDUP_OUTPUT_DIR', os.path.join(SCRIPT_DIR, "outputs"))
+
+# Scratch space for per-job working files; point this at a tmpfs such as /dev/shm to keep intermediates in RAM
+WORK_DIR = os.environ.get('SPEDUP_WORK_DIR') or None
+
+# Threads given to each ffmpeg encode; also decides how many renders fit on the machine
+FFMPEG_THREADS = max(1, int(os.environ.get('SPEDUP_FFMPEG_THREADS', 4)))
+
+# 'native' keeps the downloaded opus/m4a stream and encodes AAC once; 'mp3' is the old double MP3 transcode
+AUDIO_MODE = os.environ.get('SPEDUP_AUDIO_MODE', 'native')
+# Version of the speed-change filter chain in process_audio; bump it when the chain changes so cached results are not reused
+AUDIO_FILTER_VERSION = 1
+
+# 'loop' encodes a short background segment once and repeats it by stream copy, 'chunked' encodes the whole
+# timeline in parallel chunks, 'graph' renders the whole video with a single ffmpeg filter graph and 'staged'
+# runs one ffmpeg per step; 'loop' and 'chunked' fall back to 'graph', which falls back to 'staged'
+RENDER_MODE = os.environ.get('SPEDUP_RENDER_MODE', 'loop')
+
+# Still images are encoded as one short segment of this many seconds that is then repeated to the song length
+STILL_SEGMENT_SECONDS = 10
+# Frame rate of still-image videos; the picture never changes, so more frames only cost encode time
+STILL_FPS = max(1, int(os.environ.get('SPEDUP_STILL_FPS', 2)))
+
+# Chunked mode: seconds of video timeline per independently encoded chunk, the threads a chunked job may use
+# in total (by default the whole machine, not one worker slot's FFMPEG_THREADS) and how many chunks encode at once
+CHUNK_SECONDS = max(1, int(os.environ.get('SPEDUP_CHUNK_SECONDS', 60)))
+CHUNK_THREADS = max(1, int(os.environ.get('SPEDUP_CHUNK_THREADS', os.cpu_count() or FFMPEG_THREADS)))
+CHUNK_PARALLELISM = max(1, int(os.environ.get('SPEDUP_CHUNK_PARALLEL', CHUNK_THREADS)))
+# Largest length difference between the audio and video streams accepted in a finished video, in seconds
+AV_SYNC_TOLERANCE = 0.2
+
+# GIF cycles shorter than this are encoded several times over, so the concat list stays short
+GIF_MIN_SEGMENT_SECONDS = 5
+
+# Frame rate every GIF used to be converted to; GIFs now keep their own timing up to GIF_MAX_FPS
+LEGACY_GIF_FPS = 30
+GIF_MAX_FPS = float(os.environ.get('SPEDUP_GIF_MAX_FPS', LEGACY_GIF_FPS))
+
+# How much more an animated GIF background costs to encode than a still image, per second of output
+GIF_COST_WEIGHT = 3.0
+
+def quote_path(path):
+    return f'"{path}"'
+
+def default_worker_count():
+    """Number of renders that fit on this machine when each encode uses FFMPEG_THREADS threads"""
+    return max(1, (os.cpu_count() or 1) // FFMPEG_THREADS)
+
+def init_worker():
+    """Process pool initializer: load yt_dlp's extractors and ffmpeg's capabilities once per worker instead of once per job"""
+    # The extractor classes are imported lazily on first use, which is the slow part of yt_dlp startup
+    yt_dlp.extractor.gen_extractor_classes()
+    get_capabilities(FFMPEG_PATH)
+    print(f"Render worker {os.getpid()} ready")
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled"""
+
+def raise_if_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelled()
+
+def kill_process_tree(process):
+    """Kill a child started in its own process group, together with everything it spawned"""
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, ProcessLookupError) as e:
+        print(f"Warning: Could not kill process {process.pid}: {e}")
+
+def kill_on_cancel(process, cancel_event):
+    """Watch a running child and kill it as soon as the job is cancelled"""
+    while process.poll() is None:
+        if cancel_event.wait(0.5):
+            kill_process_tree(process)
+            return
+
+def yt_dlp_cancel_hook(cancel_event):
+    """yt-dlp progress/postprocessor hook that aborts the download once the job is cancelled"""
+    def hook(progress):
+        raise_if_cancelled(cancel_event)
+    
+    return hook
+
+def run_ffmpeg(args, check=False, on_progress=None, cancel_event=None):
+    """Run ffmpeg with machine-readable -progress output
+
+    args is the command line after the ffmpeg binary. on_progress(out_time, speed) is
+    called for every progress block ffmpeg emits, with out_time in seconds of output
+    written and speed as a multiple of realtime (None while ffmpeg cannot tell yet).
+    Setting cancel_event kills ffmpeg and raises JobCancelled.
+    """
+    raise_if_cancelled(cancel_event)
+    command = f'{quote_path(FFMPEG_PATH)} -progress pipe:1 -nostats {args}'
+    # Own process group, so a cancel can kill the shell and the ffmpeg under it in one go
+    if os.name == 'nt':
+        group_args = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group_args = {'start_new_session': True}
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, text=True, **group_args)
+    if cancel_event is not None:
+        threading.Thread(target=kill_on_cancel, args=(process, cancel_event), daemon=True).start()
+    
+    out_time = None
+    speed = None
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        if key == 'out_time_us' and value.isdigit():
+            out_time = int(value) / 1000000
+        elif key == 'speed':
+            try:
+                speed = float(value.rstrip('x'))
+            except ValueError:
+                speed = None
+        elif key == 'progress':
+            # Each block ends with progress=continue, the last one with progress=end
+            if on_progress and out_time is not None:
+                on_progress(out_time, speed)
+    
+    returncode = process.wait()
+    raise_if_cancelled(cancel_event)
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return returncode
+
+def ffmpeg_progress_reporter(update_status, start, end, duration):
+    """Map ffmpeg's position in the output onto the job's start..end progress range"""
+    def report(out_time, speed):
+        fields = {'speed': speed, 'eta': None}
+        if duration:
+            fraction = min(max(out_time / duration, 0.0), 1.0)
+            fields['progress'] = round(start + (end - start) * fraction, 1)
+            if speed:
+                fields['eta'] = round(max(duration - out_time, 0.0) / speed, 1)
+        update_status(**fields)
+    
+    return report
+
+def create_job_workspace():
+    """Create an empty scratch directory for a single job"""
+    if WORK_DIR and not os.path.exists(WORK_DIR):
+        os.makedirs(WORK_DIR, exist_ok=True)
+    return tempfile.mkdtemp(prefix='spedup-job-', dir=WORK_DIR)
+
+def remove_job_workspace(workspace):
+    """Delete a job's scratch directory and everything left in it"""
+    shutil.rmtree(workspace, ignore_errors=True)
+    if os.path.exists(workspace):
+        print(f"Warning: Could not remove job workspace {workspace}")
+
+def reserve_output_path(output_folder, filename):
+    """Claim a free name for filename in output_folder and return its path
+
+    The name is taken by creating an empty file with O_EXCL, so two jobs
+    finishing the same track at the same time never get the same path.
+    """
+    stem, ext = os.path.splitext(filename)
+    timestamp = int(time.time())
+    attempt = 0
+    while True:
+        if attempt == 0:
+            candidate = filename
+        elif attempt == 1:
+            candidate = f"{stem}_{timestamp}{ext}"
+        else:
+            candidate = f"{stem}_{timestamp}_{attempt}{ext}"
+        path = os.path.join(output_folder, candidate)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            attempt += 1
+
+def audio_format_selector():
+    """yt-dlp format selector of a job's audio download"""
+    if AUDIO_MODE == 'native':
+        # Prefer the formats ffmpeg decodes natively, without any postprocessor pass
+        return 'bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio/best'
+    return 'bestaudio/best'
+
+def audio_downloader(workspace, cancel_event=None):
+    """YoutubeDL set up to save a track's audio into the workspace
+
+    In 'native' audio mode the best audio stream (opus/m4a) is saved as-is; in
+    'mp3' mode yt-dlp transcodes it to a 192k MP3 as it always used to.
+    """
+    base_audio_name = os.path.join(workspace, "source_audio")
+    ydl_opts = {
+        'outtmpl': f'{base_audio_name}.%(ext)s',
+        'format': audio_format_selector(),
+        'progress_hooks': [yt_dlp_cancel_hook(cancel_event)],
+        'postprocessor_hooks': [yt_dlp_cancel_hook(cancel_event)],
+    }
+    if AUDIO_MODE != 'native':
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }]
+    return yt_dlp.YoutubeDL(ydl_opts)
+
+def source_audio_key(youtube_url):
+    """Key of a track's downloaded audio in the source audio cache, None when the URL has no video ID"""
+    track_key = metadata_key(youtube_url)
+    # The same track downloads differently in native and mp3 mode
+    return f'{track_key}/{AUDIO_MODE}' if track_key else None
+
+def download_audio(ydl, youtube_url, workspace, video_info=None):
+    """Download a track's audio with ydl and return the file's path
+
+    Tracks in the source audio cache are linked into the workspace without
+    any network request. video_info is the full info dict of an earlier
+    ydl.extract_info call; downloading from it reuses the resolved formats
+    instead of extracting the page a second time. Without it (cached metadata
+    has no format URLs) the track is extracted and downloaded in one go.
+    """
+    cache_key = source_audio_key(youtube_url)
+    if cache_key:
+        try:
+            cached = get_source_audio_cache().fetch(cache_key, os.path.join(workspace, "source_audio"))
+        except Exception as e:
+            print(f"Warning: Could not read the source audio cache: {e}")
+            cached = None
+        if cached:
+            print(f"Using cached audio for {cache_key} (format {cached[1]['meta'].get('format_id')})")
+            return cached[0]
+    
+    if video_info is None:
+        downloaded_info = ydl.extract_info(youtube_url, download=True)
+    else:
+        downloaded_info = ydl.process_ie_result(video_info, download=True)
+    
+    # Find the actual downloaded audio file
+    for filename in sorted(os.listdir(workspace)):
+        if filename.startswith("source_audio.") and not filename.endswith(('.part', '.ytdl')):
+            audio_file = os.path.join(workspace, filename)
+            break
+    else:
+        raise Exception("Could not find downloaded audio file")
+    
+    if cache_key:
+        try:
+            get_source_audio_cache().put(cache_key, audio_file, {'format_id': (downloaded_info or {}).get('format_id')})
+        except Exception as e:
+            print(f"Warning: Could not add the audio to the source audio cache: {e}")
+    return audio_file
+
+def probe_sample_rate(audio_file, default=44100):
+    """Sample rate of the first audio stream, or default when ffprobe cannot tell"""
+    result = subprocess.run(
+        [FFPROBE_PATH, '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=sample_rate', '-of', 'default=noprint_wrappers=1:nokey=1', audio_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    try:
+        return int(result.stdout.strip())
+    except ValueError:
+        return default
+
+def processed_audio_key(source_audio, pitch, audio_bitrate):
+    """Key of a speed change in the processed audio cache: source content, speed, audio mode and filter chain"""
+    # Both modes encode at the profile's bitrate, so it is part of the result
+    return f'{file_sha256(source_audio)}/{pitch!r}/{AUDIO_MODE}/v{AUDIO_FILTER_VERSION}/{audio_bitrate}'
+
+def process_audio(source_audio, workspace, pitch, audio_bitrate, on_progress=None, cancel_event=None):
+    """Apply the speed/pitch change and return (processed file, ffmpeg audio args for the final mux)
+
+    In 'native' mode the source stream is resampled at its own rate and encoded
+    straight to the final AAC, so the mux only copies it. In 'mp3' mode the
+    change is written to an MP3 at audio_bitrate, which the mux encodes to AAC
+    and audio-only jobs deliver as-is.
+    Results are kept in the processed audio cache, so rendering a track again
+    at the same speed with another background or profile skips this pass.
+    """
+    if AUDIO_MODE == 'native':
+        audio_mux_args = '-c:a copy'
+    else:
+        audio_mux_args = f'-c:a aac -strict experimental -b:a {audio_bitrate}'
+    
+    try:
+        cache_key = processed_audio_key(source_audio, pitch, audio_bitrate)
+        cached = get_processed_audio_cache().fetch(cache_key, os.path.join(workspace, "audio"))
+    except Exception as e:
+        print(f"Warning: Could not read the processed audio cache: {e}")
+        cache_key = None
+        cached = None
+    if cached:
+        print(f"Using cached processed audio for speed {pitch}")
+        return cached[0], audio_mux_args
+    
+    if AUDIO_MODE == 'native':
+        # asetrate has to start from the real input rate: opus is 48 kHz, not the 44.1 kHz the mp3 path assumes
+        sample_rate = probe_sample_rate(source_audio)
+        processed_audio = os.path.join(workspace, "audio.m4a")
+        command = f'-i {quote_path(source_audio)} -vn -af "asetrate={sample_rate}*{pitch},aresample={sample_rate}" -c:a aac -b:a {audio_bitrate} {quote_path(processed_audio)} -y'
+    else:
+        processed_audio = os.path.join(workspace, "audio.mp3")
+        command = f'-i {quote_path(source_audio)} -af "asetrate=44100*{pitch},aresample=44100" -acodec libmp3lame -b:a {audio_bitrate} {quote_path(processed_audio)} -y'
+    run_ffmpeg(command, check=True, on_progress=on_progress, cancel_event=cancel_event)
+    
+    if cache_key:
+        try:
+            get_processed_audio_cache().put(cache_key, processed_audio, {'pitch': pitch, 'audio_mode': AUDIO_MODE})
+        except Exception as e:
+            print(f"Warning: Could not add the audio to the processed audio cache: {e}")
+    return processed_audio, audio_mux_args
+
+def speed_factor(speed_choice, custom_speed=None):
+    """Playback rate for a job: the custom speed if provided, otherwise the preset for slow/fast"""
+    if custom_speed is not None:
+        return custom_speed
+    return 0.9 if speed_choice == "slow" else 1.4
+
+def estimate_job_cost(params):
+    """Relative render cost of a queued job, used to schedule short jobs first
+
+    The cost is the output length in seconds (track duration / speed), weighted
+    by how expensive the background is to encode. Returns None when the track
+    duration is unknown.
+    """
+    # Same format selection as the download, so the metadata cache records the format the job will use
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'format': audio_format_selector()}) as ydl:
+        info, _ = cached_extract_info(ydl, params['youtube_url'])
+    duration = info.get('duration')
+    if not duration:
+        return None
+    output_duration = duration / speed_factor(params['speed_choice'], params.get('custom_speed'))
+    weight = GIF_COST_WEIGHT if params['media_type'] == 'gif' else 1.0
+    return {'track_duration': duration, 'estimated_cost': round(output_duration * weight, 1)}
+
+def probe_duration(media_file):
+    """Duration of a media file in seconds, as reported by ffprobe"""
+    result = subprocess.run(
+        [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', media_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT
+    )
+    return float(result.stdout)
+
+def probe_streams(media_file):
+    """Container and stream details of a media file from ffprobe, or None if it cannot be read"""
+    result = subprocess.run(
+        [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name,pix_fmt,duration', '-of', 'json', media_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+def is_copyable_video(media_file, codec_name='h264'):
+    """True if the file's video stream can be copied into the output as-is (codec_name, yuv420p)"""
+    info = probe_streams(media_file)
+    if not info:
+        return False
+    video = [stream for stream in info.get('streams', []) if stream.get('codec_type') == 'video']
+    return bool(video) and video[0].get('codec_name') == codec_name and video[0].get('pix_fmt') == 'yuv420p'
+
+def verify_mp4_output(media_file, codec_name='h264'):
+    """Check that a finished file is an MP4 with a codec_name video stream and an audio stream"""
+    info = probe_streams(media_file)
+    if not info:
+        return False
+    container = info.get('format', {})
+    streams = info.get('streams', [])
+    try:
+        duration = float(container.get('duration', 0))
+    except ValueError:
+        duration = 0
+    return (
+        'mp4' in container.get('format_name', '')
+        and duration > 0
+        and is_copyable_video(media_file, codec_name)
+        and any(stream.get('codec_type') == 'audio' for stream in streams)
+    )
+
+def longest_frame_duration(video_file):
+    """Longest frame of a video in seconds (GIF frame delays vary), 0 when ffprobe cannot tell"""
+    result = subprocess.run(
+        [FFPROBE_PATH, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=duration_time', '-of', 'csv=p=0', video_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    durations = []
+    for line in result.stdout.split():
+        try:
+            durations.append(float(line.strip(',')))
+        except ValueError:
+            pass
+    return max(durations, default=0)
+
+def check_av_sync(media_file, tolerance=AV_SYNC_TOLERANCE, frame_duration=0):
+    """Raise if the audio and video streams of a finished file differ in length by more than tolerance seconds
+
+    A stream-copied video can only be cut at frame boundaries, so its last
+    frame may run past the audio by up to frame_duration; that overhang is not
+    counted as drift.
+    """
+    info = probe_streams(media_file) or {}
+    durations = {}
+    for stream in info.get('streams', []):
+        try:
+            durations.setdefault(stream.get('codec_type'), float(stream['duration']))
+        except (KeyError, ValueError):
+            pass
+    if 'video' not in durations or 'audio' not in durations:
+        raise Exception("Could not read stream durations to check A/V sync")
+    drift = durations['video'] - durations['audio']
+    if drift > 0:
+        drift = max(0, drift - frame_duration)
+    drift = abs(drift)
+    if drift > tolerance:
+        raise Exception(f"Audio and video are out of sync by {drift:.2f}s")
+
+def render_single_pass(media_type, bg_filename, source_audio, output_video, pitch, duration, has_hw_accel, profile, on_progress=None, cancel_event=None, frame_rate_args='-r 30'):
+    """Render the final video in one ffmpeg run
+
+    A single filter graph scales and loops the background, applies the
+    speed/pitch change to the downloaded audio and encodes both straight into
+    the MP4, so no intermediate audio, image or video file touches the disk.
+    """
+    sample_rate = probe_sample_rate(source_audio)
+    # A GIF is replayed from the start; a still image is repeated as a single frame
+    loop_input = '-stream_loop -1' if media_type == 'gif' else '-loop 1'
+    graph = (
+        f'[0:v]{scale_filter(profile)},format=yuv420p[v];'
+        f'[1:a]asetrate={sample_rate}*{pitch},aresample={sample_rate}[a]'
+    )
+    command = (
+        f'{loop_input} -i {quote_path(bg_filename)} -i {quote_path(source_audio)} '
+        f'-filter_complex "{graph}" -map "[v]" -map "[a]" {frame_rate_args} {video_codec_args(profile, FFMPEG_THREADS, has_hw_accel)} '
+        f'-c:a aac -b:a {profile["audio_bitrate"]} -t {duration} -movflags +faststart {quote_path(output_video)} -y'
+    )
+    try:
+        run_ffmpeg(command, check=True, on_progress=on_progress, cancel_event=cancel_event)
+    except subprocess.CalledProcessError:
+        if not (has_hw_accel and profile['hw_codec']):
+            raise
+        # NVENC can refuse a session (busy GPU, unsupported size); retry the same graph on the CPU
+        print(f"NVENC single-pass render failed, retrying with {profile['codec']}...")
+        command = command.replace(video_codec_args(profile, FFMPEG_THREADS, True), video_codec_args(profile, FFMPEG_THREADS))
+        run_ffmpeg(command, check=True, on_progress=on_progress, cancel_event=cancel_event)
+
+def prepare_audio(update_status, source_audio, workspace, pitch, expected_duration, profile, cancel_event=None):
+    """Run the audio stages of a multi-step render; returns (audio file, audio mux args, duration)"""
+    # Process audio (change pitch/speed)
+    raise_if_cancelled(cancel_event)
+    update_status(stage='process_audio', progress=50, message='Processing audio...')
+    encode_progress = ffmpeg_progress_reporter(update_status, 50, 65, expected_duration)
+    audio_filename, audio_mux_args = process_audio(source_audio, workspace, pitch, profile['audio_bitrate'], encode_progress, cancel_event)
+    
+    # Get audio duration
+    raise_if_cancelled(cancel_event)
+    update_status(stage='probe_audio', progress=65, message='Preparing final video...')
+    audio_duration = probe_duration(audio_filename)
+    return audio_filename, audio_mux_args, audio_duration
+
+def encode_still_segment(bg_filename, workspace, profile, cancel_event=None):
+    """Encode a still image into a short video segment that can be repeated by stream copy
+
+    The segment is a single closed GOP at STILL_FPS (tuned for still images
+    with libx264), so every copy starts on a keyframe. Returns (segment file, its duration).
+    """
+    segment = os.path.join(workspace, "still_segment.mp4")
+    gop = STILL_FPS * STILL_SEGMENT_SECONDS
+    tune = ' -tune stillimage' if profile['codec'] == 'libx264' else ''
+    command = (
+        f'-loop 1 -framerate {STILL_FPS} -i {quote_path(bg_filename)} -vf "{scale_filter(profile)},format=yuv420p" '
+        f'{video_codec_args(profile, FFMPEG_THREADS)}{tune} -r {STILL_FPS} -g {gop} -bf 0 '
+        f'-t {STILL_SEGMENT_SECONDS} -an {quote_path(segment)} -y'
+    )
+    run_ffmpeg(command, check=True, cancel_event=cancel_event)
+    return segment, probe_duration(segment)
+
+def download_background_video(url, filename, headers):
+    """Download a GIF's MP4 rendition and check that ffprobe can read its video stream"""
+    response = requests.get(url, headers=headers, timeout=30)
+    response.raise_for_status()
+    if len(response.content) == 0:
+        raise Exception("Downloaded video is empty")
+    with open(filename, 'wb') as f:
+        f.write(response.content)
+    
+    info = probe_streams(filename)
+    if not info or not any(stream.get('codec_type') == 'video' for stream in info.get('streams', [])):
+        raise Exception("Downloaded file has no readable video stream")
+    print(f"Downloaded background video: {len(response.content)} bytes")
+
+def probe_gif_cycle(gif_file):
+    """Length in seconds and frame count of one play-through of an animated GIF (or its MP4 rendition)"""
+    result = subprocess.run(
+        [FFPROBE_PATH, '-v', 'error', '-count_packets', '-select_streams', 'v:0', '-show_entries', 'stream=nb_read_packets:format=duration', '-of', 'json', gif_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    info = json.loads(result.stdout)
+    duration = float(info['format']['duration'])
+    frames = int(info['streams'][0]['nb_read_packets'])
+    if duration <= 0 or frames <= 0:
+        raise Exception(f"Could not determine the loop length of {os.path.basename(gif_file)}")
+    return duration, frames
+
+def gif_timing(update_status, gif_file, duration=None):
+    """Pick the output frame rate for a GIF background and return the matching ffmpeg args
+
+    GIFs at or below GIF_MAX_FPS keep their own frame delays (variable frame
+    rate); faster ones are resampled to the cap. The native rate and the frames
+    saved over the old fixed 30 fps are reported in the job stats.
+    """
+    cycle_duration, frames = probe_gif_cycle(gif_file)
+    native_fps = frames / cycle_duration
+    output_fps = min(native_fps, GIF_MAX_FPS)
+    stats = {'gif_fps': round(native_fps, 2), 'output_fps': round(output_fps, 2)}
+    if duration:
+        stats['frames_saved'] = max(0, round(duration * (LEGACY_GIF_FPS - output_fps)))
+    update_status(**stats)
+    if native_fps > GIF_MAX_FPS:
+        return f'-r {GIF_MAX_FPS:g}'
+    if get_capabilities(FFMPEG_PATH).has_fps_mode:
+        return '-fps_mode passthrough'
+    # ffmpeg before 5.1 has no -fps_mode; newer builds still accept the deprecated -vsync
+    return '-vsync passthrough'
+
+def encode_gif_segment(bg_filename, workspace, profile, frame_rate_args='-r 30', cancel_event=None):
+    """Encode a whole number of GIF play-throughs into a segment that can be repeated by stream copy
+
+    Closed GOPs make every copy decodable on its own, and ending on a cycle
+    boundary keeps the animation seamless across copies. Returns (segment file, its duration).
+    """
+    cycle_duration, _ = probe_gif_cycle(bg_filename)
+    cycles = max(1, math.ceil(GIF_MIN_SEGMENT_SECONDS / cycle_duration))
+    segment = os.path.join(workspace, "gif_segment.mp4")
+    command = (
+        f'-stream_loop {cycles - 1} -i {quote_path(bg_filename)} -vf "{scale_filter(profile)},format=yuv420p" '
+        f'{video_codec_args(profile, FFMPEG_THREADS)} {frame_rate_args} -flags +cgop -bf 0 '
+        f'-an {quote_path(segment)} -y'
+    )
+    run_ffmpeg(command, check=True, cancel_event=cancel_event)
+    return segment, probe_duration(segment)
+
+def concat_and_mux(video_files, audio_filename, audio_mux_args, duration, output_video, on_progress=None, cancel_event=None):
+    """Join video files with the concat demuxer, copying the video, and mux in the audio up to duration"""
+    concat_list = os.path.splitext(video_files[0])[0] + '.txt'
+    with open(concat_list, 'w') as f:
+        # Entries are relative to the list file, which sits next to the videos
+        for video_file in video_files:
+            f.write(f"file '{os.path.basename(video_file)}'\n")
+    command = (
+        f'-f concat -safe 0 -i {quote_path(concat_list)} -i {quote_path(audio_filename)} -map 0:v:0 -map 1:a:0 '
+        f'-c:v copy {audio_mux_args} -t {duration} -movflags +faststart {quote_path(output_video)} -y'
+    )
+    run_ffmpeg(command, check=True, on_progress=on_progress, cancel_event=cancel_event)
+
+def encode_background_segment(media_type, bg_filename, workspace, profile, frame_rate_args='-r 30', cancel_event=None):
+    """Encode the repeatable segment of a looped render; returns (segment file, its duration)"""
+    if media_type == 'gif':
+        return encode_gif_segment(bg_filename, workspace, profile, frame_rate_args, cancel_event)
+    return encode_still_segment(bg_filename, workspace, profile, cancel_event)
+
+def render_looped(update_status, media_type, bg_filename, source_audio, output_video, pitch, expected_duration, workspace, profile, cancel_event=None, frame_rate_args='-r 30', segment=None):
+    """Render by encoding a short background segment once and repeating it by stream copy
+
+    Video encode cost follows the length of the image segment or GIF cycle, not
+    the song. Always uses the profile's software encoder: a segment is too
+    short for NVENC to be worth a GPU session. segment is an optional
+    (file, duration) pair already encoded by prepare_background.
+    """
+    audio_filename, audio_mux_args, audio_duration = prepare_audio(update_status, source_audio, workspace, pitch, expected_duration, profile, cancel_event)
+    
+    raise_if_cancelled(cancel_event)
+    update_status(stage='encode_video', progress=75, message='Creating video...')
+    if segment is None:
+        segment = encode_background_segment(media_type, bg_filename, workspace, profile, frame_rate_args, cancel_event)
+    segment, segment_duration = segment
+    
+    raise_if_cancelled(cancel_event)
+    update_status(stage='mux', progress=85, message='Combining video and audio...')
+    encode_progress = ffmpeg_progress_reporter(update_status, 85, 95, audio_duration)
+    repeats = max(1, math.ceil(audio_duration / segment_duration))
+    concat_and_mux([segment] * repeats, audio_filename, audio_mux_args, audio_duration, output_video, encode_progress, cancel_event)
+    if not verify_mp4_output(output_video, profile['codec_name']):
+        raise Exception("Looped render did not produce a valid MP4")
+    # Still segments hold each frame for 1 / STILL_FPS seconds, GIF frames for their own delay
+    frame_duration = longest_frame_duration(segment) if media_type == 'gif' else 1 / STILL_FPS
+    check_av_sync(output_video, frame_duration=frame_duration)
+
+def encode_chunks(media_type, bg_filename, workspace, duration, profile, frame_rate_args='-r 30', on_progress=None, cancel_event=None):
+    """Encode the background for the whole timeline as CHUNK_SECONDS chunks, CHUNK_PARALLELISM at a time
+
+    Every chunk is its own closed-GOP encode starting on a keyframe, so the
+    chunks can be joined by stream copy. CHUNK_THREADS are shared between the
+    chunks running at once. Returns the chunk files in order.
+    """
+    cycle_duration = probe_gif_cycle(bg_filename)[0] if media_type == 'gif' else None
+    chunk_count = max(1, math.ceil(duration / CHUNK_SECONDS))
+    parallelism = min(CHUNK_PARALLELISM, chunk_count)
+    threads = max(1, CHUNK_THREADS // parallelism)
+    positions = [0.0] * chunk_count
+    positions_lock = threading.Lock()
+    
+    def encode(index):
+        start = index * CHUNK_SECONDS
+        length = min(CHUNK_SECONDS, duration - start)
+        chunk = os.path.join(workspace, f"chunk_{index:04d}.mp4")
+        if media_type == 'gif':
+            # The animation repeats, so a chunk only has to seek to the same point within one cycle
+            input_args = f'-stream_loop -1 -i {quote_path(bg_filename)} -ss {start % cycle_duration}'
+        else:
+            input_args = f'-loop 1 -i {quote_path(bg_filename)}'
+        command = (
+            f'{input_args} -t {length} -vf "{scale_filter(profile)},format=yuv420p" {frame_rate_args} '
+            f'{video_codec_args(profile, threads)} -flags +cgop -an {quote_path(chunk)} -y'
+        )
+        
+        def report(out_time, speed):
+            # Overall progress is the sum of every chunk's position
+            with positions_lock:
+                positions[index] = out_time
+                total = sum(positions)
+            if on_progress:
+                on_progress(total, None)
+        
+        run_ffmpeg(command, check=True, on_progress=report, cancel_event=cancel_event)
+        return chunk
+    
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        return list(pool.map(encode, range(chunk_count)))
+
+def render_chunked(update_status, media_type, bg_filename, source_audio, output_video, pitch, expected_duration, workspace, profile, cancel_event=None, frame_rate_args='-r 30'):
+    """Render by encoding the video timeline in parallel chunks, joined by stream copy before the audio mux
+
+    Meant for hour-long tracks, where a single x264 process is the bottleneck.
+    """
+    audio_filename, audio_mux_args, audio_duration = prepare_audio(update_status, source_audio, workspace, pitch, expected_duration, profile, cancel_event)
+    
+    raise_if_cancelled(cancel_event)
+    update_status(stage='encode_video', progress=75, message='Creating video...')
+    encode_progress = ffmpeg_progress_reporter(update_status, 75, 85, audio_duration)
+    chunks = encode_chunks(media_type, bg_filename, workspace, audio_duration, profile, frame_rate_args, encode_progress, cancel_event)
+    
+    raise_if_cancelled(cancel_event)
+    update_status(stage='mux', progress=85, message='Combining video and audio...')
+    encode_progress = ffmpeg_progress_reporter(update_status, 85, 95, audio_duration)
+    concat_and_mux(chunks, audio_filename, audio_mux_args, audio_duration, output_video, encode_progress, cancel_event)
+    if not verify_mp4_output(output_video, profile['codec_name']):
+        raise Exception("Chunked render did not produce a valid MP4")
+    check_av_sync(output_video, frame_duration=longest_frame_duration(chunks[-1]) if media_type == 'gif' else 0)
+
+def render_staged(update_status, media_type, bg_filename, source_audio, output_video, pitch, expected_duration, has_hw_accel, workspace, profile, cancel_event=None, frame_rate_args='-r 30'):
+    """Render the final video step by step: audio, background video, then the mux
+
+    Every step writes an intermediate file and has its own fallbacks. Used when
+    RENDER_MODE is 'staged' or the single-pass graph fails.
+    """
+    audio_filename, audio_mux_args, audio_duration = prepare_audio(update_status, source_audio, workspace, pitch, expected_duration, profile, cancel_event)
+    
+    # Process based on media type
+    raise_if_cancelled(cancel_event)
+    update_status(stage='encode_video', progress=75, message='Creating video...')
+    encode_progress = ffmpeg_progress_reporter(update_status, 75, 85, audio_duration)
+    
+    if media_type == "gif":
+        # Create video from GIF - use original resolution
+        temp_video = os.path.join(workspace, "looped_video.mp4")
+        
+        video_encoder = video_codec_args(profile, FFMPEG_THREADS, has_hw_accel)
+        command = f'-stream_loop -1 -i {quote_path(bg_filename)} -vf "{scale_filter(profile)}" -t {audio_duration} -pix_fmt yuv420p {video_encoder} {frame_rate_args} {quote_path(temp_video)} -y'
+        
+        try:
+            run_ffmpeg(command, check=True, on_progress=encode_progress, cancel_event=cancel_event)
+        except subprocess.CalledProcessError:
+            # Fallback: try without scaling to preserve original resolution
+            command = f'-stream_loop -1 -i {quote_path(bg_filename)} -t {audio_duration} -pix_fmt yuv420p {video_codec_args(profile, FFMPEG_THREADS)} {frame_rate_args} {quote_path(temp_video)} -y'
+            run_ffmpeg(command, on_progress=encode_progress, cancel_event=cancel_event)
+    else:
+        # Create video from static image
+        temp_video = os.path.join(workspace, "image_video.mp4")
+        
+        # Resize image first with better error handling
+        resized_image = os.path.join(workspace, "resized_background.jpg")
+        
+        # Try with pixel format conversion first
+        resize_command = f'-i {quote_path(bg_filename)} -vf "{scale_filter(profile)}" -pix_fmt rgb24 {quote_path(resized_image)} -y'
+        try:
+            run_ffmpeg(resize_command, check=True, cancel_event=cancel_event)
+        except subprocess.CalledProcessError:
+            print("First resize attempt failed, trying with different format...")
+            # Fallback: try without pixel format specification
+            resize_command = f'-i {quote_path(bg_filename)} -vf "{scale_filter(profile)}" {quote_path(resized_image)} -y'
+            try:
+                run_ffmpeg(resize_command, check=True, cancel_event=cancel_event)
+            except subprocess.CalledProcessError:
+                print("Second resize attempt failed, trying simpler scaling...")
+                # Fallback: try with simpler scaling
+                resize_command = f'-i {quote_path(bg_filename)} -vf "scale=1280:720" {quote_path(resized_image)} -y'
+                run_ffmpeg(resize_command, check=True, cancel_event=cancel_event)
+        
+        video_encoder = video_codec_args(profile, FFMPEG_THREADS, has_hw_accel)
+        video_command = f'-loop 1 -i {quote_path(resized_image)} {video_encoder} -t {audio_duration} -pix_fmt yuv420p -r 30 {quote_path(temp_video)} -y'
+        
+        try:
+            run_ffmpeg(video_command, check=True, on_progress=encode_progress, cancel_event=cancel_event)
+        except subprocess.CalledProcessError:
+            video_command = f'-loop 1 -i {quote_path(resized_image)} {video_codec_args(profile, FFMPEG_THREADS)} -t {audio_duration} -pix_fmt yuv420p -r 30 {quote_path(temp_video)} -y'
+            run_ffmpeg(video_command, check=True, on_progress=encode_progress, cancel_event=cancel_event)
+        
+        if os.path.exists(resized_image):
+            os.remove(resized_image)
+    
+    # Combine video and audio
+    raise_if_cancelled(cancel_event)
+    update_status(stage='mux', progress=85, message='Combining video and audio...')
+    
+    encode_progress = ffmpeg_progress_reporter(update_status, 85, 95, audio_duration)
+    
+    # temp_video is already encoded with the profile's codec, so the fast path only copies it next to the audio
+    muxed = False
+    if is_copyable_video(temp_video, profile['codec_name']):
+        command = f'-i {quote_path(temp_video)} -i {quote_path(audio_filename)} -map 0:v:0 -map 1:a:0 -c:v copy {audio_mux_args} -shortest -movflags +faststart {quote_path(output_video)} -y'
+        try:
+            run_ffmpeg(command, check=True, on_progress=encode_progress, cancel_event=cancel_event)
+            muxed = verify_mp4_output(output_video, profile['codec_name'])
+        except subprocess.CalledProcessError as e:
+            print(f"Stream-copy mux failed: {e}")
+        if not muxed:
+            print("Stream-copy mux did not produce a valid MP4, re-encoding the video...")
+    
+    if not muxed:
+        if has_hw_accel and profile['hw_codec']:
+            command = f'-hwaccel cuda -i {quote_path(temp_video)} -i {quote_path(audio_filename)} {video_codec_args(profile, FFMPEG_THREADS, True)} {audio_mux_args} -shortest {quote_path(output_video)} -y'
+            try:
+                run_ffmpeg(command, check=True, on_progress=encode_progress, cancel_event=cancel_event)
+            except subprocess.CalledProcessError:
+                command = f'-i {quote_path(temp_video)} -i {quote_path(audio_filename)} -c:v copy {audio_mux_args} -shortest {quote_path(output_video)} -y'
+                run_ffmpeg(command, on_progress=encode_progress, cancel_event=cancel_event)
+        else:
+            command = f'-i {quote_path(temp_video)} -i {quote_path(audio_filename)} {video_codec_args(profile, FFMPEG_THREADS)} {audio_mux_args} -shortest {quote_path(output_video)} -y'
+            try:
+                run_ffmpeg(command, check=True, on_progress=encode_progress, cancel_event=cancel_event)
+            except subprocess.CalledProcessError:
+                command = f'-i {quote_path(temp_video)} -i {quote_path(audio_filename)} -c:v copy {audio_mux_args} -shortest {quote_path(output_video)} -y'
+                run_ffmpeg(command, on_progress=encode_progress, cancel_event=cancel_event)
+    
+    # The background video is only an intermediate; the mux output is what the job produces
+    if os.path.exists(temp_video):
+        os.remove(temp_video)
+
+def download_background(media_type, bg_url, workspace, bg_video_url=None):
+    """Download the job's background image or GIF into the workspace and return its path
+
+    For GIFs, the MP4 rendition at bg_video_url is tried first.
+    """
+    # Initialize filenames
+    if media_type == "gif":
+        bg_filename = os.path.join(workspace, "background.gif")
+    else:
+        bg_filename = os.path.join(workspace, "background.jpg")
+    
+    # Download with better error handling and headers
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    
+    # A GIF's MP4 rendition is far smaller and cheaper to decode; the GIF itself is the fallback
+    bg_downloaded = False
+    if media_type == "gif" and bg_video_url:
+        video_filename = os.path.join(workspace, "background.mp4")
+        try:
+            download_background_video(bg_video_url, video_filename, headers)
+            bg_filename = video_filename
+            bg_downloaded = True
+        except Exception as e:
+            print(f"Could not use the MP4 rendition, downloading the GIF instead: {e}")
+    
+    if not bg_downloaded:
+        try:
+            response = requests.get(bg_url, headers=headers, timeout=30)
+            response.raise_for_status()
+            
+            # Check if we actually got image data
+            content_type = response.headers.get('content-type', '')
+            if not any(img_type in content_type.lower() for img_type in ['image', 'gif']):
+                print(f"Warning: Content-Type is {content_type}, might not be an image")
+            
+            bg_data = response.content
+            if len(bg_data) == 0:
+                raise Exception("Downloaded file is empty")
+                
+            with open(bg_filename, 'wb') as f:
+                f.write(bg_data)
+                
+            print(f"Downloaded background: {len(bg_data)} bytes, Content-Type: {content_type}")
+            
+            # Verify the downloaded file is a valid image using FFprobe
+            try:
+                probe_command = f'{quote_path(FFPROBE_PATH)} -v error -select_streams v:0 -show_entries stream=codec_name,width,height -of csv=p=0 {quote_path(bg_filename)}'
+                probe_result = subprocess.run(probe_command, shell=True, capture_output=True, text=True)
+                if probe_result.returncode == 0:
+                    print(f"Image validation successful: {probe_result.stdout.strip()}")
+                else:
+                    print(f"Image validation failed: {probe_result.stderr}")
+                    raise Exception(f"Downloaded file is not a valid image: {probe_result.stderr}")
+            except Exception as probe_error:
+                print(f"Image validation error: {probe_error}")
+                raise Exception(f"Downloaded image file is corrupted or invalid")
+            
+        except Exception as e:
+            raise Exception(f"Failed to download background image: {str(e)}")
+    
+    return bg_filename
+
+def concat_available():
+    """False when the ffmpeg build is known to lack the concat demuxer the loop and chunked engines join with"""
+    capabilities = get_capabilities(FFMPEG_PATH)
+    return not capabilities.known or capabilities.has_demuxer('concat')
+
+def prepare_background(update_status, media_type, bg_filename, workspace, profile, expected_duration=None, cancel_event=None):
+    """Work out the background's frame timing and, in loop mode, encode its repeatable segment
+
+    Needs nothing from the audio, so it runs while the audio downloads.
+    Returns (frame rate args, segment), segment being None when it is left to the render engine.
+    """
+    frame_rate_args = '-r 30'
+    if media_type == "gif":
+        try:
+            frame_rate_args = gif_timing(update_status, bg_filename, expected_duration)
+        except Exception as e:
+            print(f"Could not read GIF timing, converting to {LEGACY_GIF_FPS} fps: {e}")
+    
+    segment = None
+    if RENDER_MODE == 'loop' and concat_available():
+        try:
+            segment = encode_background_segment(media_type, bg_filename, workspace, profile, frame_rate_args, cancel_event)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"Could not encode the background segment ahead of the audio: {e}")
+    return frame_rate_args, segment
+
+def render_video(update_status, media_type, bg_filename, source_audio, output_video, pitch, expected_duration, workspace, profile, cancel_event=None, frame_rate_args='-r 30', segment=None):
+    """Render the final video with the engine picked by RENDER_MODE, falling back to the next engine on failure
+
+    frame_rate_args and segment come from prepare_background.
+    """
+    # resolve_profile only keeps an NVENC codec that works on this machine
+    has_hw_accel = bool(profile['hw_codec'])
+    
+    rendered = False
+    if RENDER_MODE in ('loop', 'chunked') and not concat_available():
+        print("This ffmpeg build has no concat demuxer, using the single-pass render")
+    elif RENDER_MODE == 'loop':
+        try:
+            render_looped(update_status, media_type, bg_filename, source_audio, output_video, pitch, expected_duration, workspace, profile, cancel_event, frame_rate_args, segment)
+            rendered = True
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"Loop render failed, falling back to single-pass render: {e}")
+    elif RENDER_MODE == 'chunked':
+        try:
+            render_chunked(update_status, media_type, bg_filename, source_audio, output_video, pitch, expected_duration, workspace, profile, cancel_event, frame_rate_args)
+            rendered = True
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"Chunked render failed, falling back to single-pass render: {e}")
+    
+    if not rendered and RENDER_MODE in ('loop', 'chunked', 'graph'):
+        raise_if_cancelled(cancel_event)
+        update_status(stage='render', progress=50, message='Rendering video...')
+        try:
+            output_duration = probe_duration(source_audio) / pitch
+            encode_progress = ffmpeg_progress_reporter(update_status, 50, 95, output_duration)
+            render_single_pass(media_type, bg_filename, source_audio, output_video, pitch, output_duration, has_hw_accel, profile, encode_progress, cancel_event, frame_rate_args)
+            rendered = True
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"Single-pass render failed, falling back to step-by-step render: {e}")
+    
+    if not rendered:
+        render_staged(update_status, media_type, bg_filename, source_audio, output_video, pitch, expected_duration, has_hw_accel, workspace, profile, cancel_event, frame_rate_args)
+
+def render_audio_only(update_status, source_audio, output_video, pitch, expected_duration, workspace, profile, cancel_event=None):
+    """Produce just the processed audio track; returns its path, output_video with the audio file's extension"""
+    audio_filename, _, _ = prepare_audio(update_status, source_audio, workspace, pitch, expected_duration, profile, cancel_event)
+    output_audio = os.path.splitext(output_video)[0] + os.path.splitext(audio_filename)[1]
+    shutil.move(audio_filename, output_audio)
+    return output_audio
+
+def process_video_task(update_status, youtube_url, media_type, bg_url, speed_choice, save_credits, custom_speed=None, cancel_event=None, bg_video_url=None, profile=None):
+    """Background task for video processing, reports progress through update_status(**fields)
+
+    cancel_event is any object with is_set()/wait() (threading or multiprocessing Event);
+    setting it kills the running ffmpeg or yt-dlp step and ends the job as 'cancelled'.
+    For GIF jobs, bg_video_url is an optional MP4 rendition used in place of bg_url.
+    profile names the output profile (see profiles.OUTPUT_PROFILES), the default one when None.
+    """
+    # Every job works in its own scratch directory so concurrent renders never share files
+    workspace = create_job_workspace()
+    
+    try:
+        update_status(status='processing', progress=10, message='Starting video processing...')
+        output_profile = resolve_profile(get_profile(profile), get_capabilities(FFMPEG_PATH))
+        audio_only = output_profile['codec'] is None
+        
+        pitch = speed_factor(speed_choice, custom_speed)
+        
+        # The job is a small dependency graph: the background is fetched while the track is extracted and
+        # its audio downloaded, and the background's loop segment is encoded while the audio is still downloading.
+        # The track is extracted once (or not at all when its metadata is cached); the same YoutubeDL downloads from that info dict.
+        with audio_downloader(workspace, cancel_event) as ydl, ThreadPoolExecutor(max_workers=2) as branches:
+            raise_if_cancelled(cancel_event)
+            # The branches overlap, so they share one 'download' stage and each reports its own wall time as a stat
+            update_status(stage='download', progress=15, message='Getting video info...')
+            
+            def timed(stat, task, *args):
+                started = time.time()
+                result = task(*args)
+                update_status(**{stat: round(time.time() - started, 3)})
+                return result
+            
+            metadata = branches.submit(timed, 'metadata_seconds', cached_extract_info, ydl, youtube_url)
+            
+            def background_branch():
+                bg_filename = download_background(media_type, bg_url, workspace, bg_video_url)
+                # Only the GIF stats need the output duration, which the metadata branch provides
+                source_duration = metadata.result()[0].get('duration') if media_type == "gif" else None
+                expected_duration = source_duration / pitch if source_duration else None
+                frame_rate_args, segment = prepare_background(update_status, media_type, bg_filename, workspace, output_profile, expected_duration, cancel_event)
+                return bg_filename, frame_rate_args, segment
+            
+            background = None
+            if not audio_only:
+                # Download selected background
+                update_status(progress=20, message=f'Downloading {"GIF" if media_type == "gif" else "Image"}...')
+                background = branches.submit(timed, 'background_seconds', background_branch)
+            
+            video_info, metadata_cached = metadata.result()
+            
+            # Download YouTube audio only, unless the background has already failed
+            raise_if_cancelled(cancel_event)
+            if background and background.done() and background.exception():
+                raise background.exception()
+            update_status(progress=25, message='Downloading audio...', metadata_cached=metadata_cached)
+            downloaded_audio = timed('audio_download_seconds', download_audio, ydl, youtube_url, workspace, None if metadata_cached else video_info)
+            
+            raise_if_cancelled(cancel_event)
+            update_status(progress=35, message='Finishing downloads...')
+            if background:
+                bg_filename, frame_rate_args, segment = background.result()
+        
+        # Create appropriate filename based on speed choice
+        if speed_choice == "slow":
+            prefix = "slowed_down_"
+        else:  # speed up
+            prefix = "nightcore_"
+            
+        # More thorough sanitization of the filename
+        video_title = video_info['title']
+        sanitized_title = re.sub(r'[^a-zA-Z0-9]', '_', video_title)
+        sanitized_title = re.sub(r'_{2,}', '_', sanitized_title)
+        if len(sanitized_title) > 50:
+            sanitized_title = sanitized_title[:50]
+        sanitized_filename = f"{prefix}{sanitized_title}"
+        output_video = os.path.join(workspace, f"{sanitized_filename}.mp4")
+        
+        # Speed change shortens or stretches the track, so the output runs for duration / pitch
+        source_duration = video_info.get('duration')
+        expected_duration = source_duration / pitch if source_duration else None
+        
+        if audio_only:
+            output_video = render_audio_only(update_status, downloaded_audio, output_video, pitch, expected_duration, workspace, output_profile, cancel_event)
+        else:
+            render_video(update_status, media_type, bg_filename, downloaded_audio, output_video, pitch, expected_duration, workspace, output_profile, cancel_event, frame_rate_args, segment)
+        current_dir_output = output_video
+        
+        # Temporary files are removed with the workspace once the output has been moved
+        raise_if_cancelled(cancel_event)
+        update_status(stage='finalize', progress=95, message='Cleaning up...')
+        
+        # Move to outputs folder
+        output_folder = OUTPUT_DIR
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        
+        # Find the created file
+        if not os.path.exists(current_dir_output):
+            output_extension = os.path.splitext(current_dir_output)[1]
+            possible_files = [f for f in os.listdir(workspace) if f.endswith(output_extension)]
+            if possible_files:
+                current_dir_output = os.path.join(workspace, possible_files[0])
+            else:
+                raise Exception(f"No {output_extension[1:].upper()} output file found")
+        
+        # Move to outputs folder, over the placeholder that reserves the name
+        output_path = reserve_output_path(output_folder, os.path.basename(current_dir_output))
+        try:
+            shutil.move(current_dir_output, output_path)
+        except Exception:
+            os.remove(output_path)
+            raise
+        
+        update_status(status='complete', progress=100, message='Video created successfully!', output_file=output_path, speed=None, eta=None)
+        
+    except JobCancelled:
+        update_status(status='cancelled', message='Job cancelled', speed=None, eta=None)
+        print("Video processing cancelled")
+    except Exception as e:
+        update_status(status='error', message=f'Error creating video: {str(e)}', speed=None, eta=None)
+        print(f"Error in video processing: {e}")
+    finally:
+        remove_job_workspace(workspace)
@@ -0,0 +1,106 @@
+import os
+
+import caches
+from caches import FileCache, MetadataCache
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+AUDIO_SELECTOR = 'bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio/best'
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL: counts extractions and picks a format by selector"""
+
+    def __init__(self, format_selector=None):
+        self.params = {'format': format_selector} if format_selector else {}
+        self.extractions = 0
+
+    def extract_info(self, url, download=False):
+        self.extractions += 1
+        format_id = '251' if self.params.get('format') else '137+251'
+        return {'id': 'dQw4w9WgXcQ', 'extractor_key': 'Youtube', 'title': 'Song', 'duration': 212,
+                'format_id': format_id, 'ext': 'webm', 'formats': [{'format_id': '251', 'url': 'https://expiring'}]}
+
+
+def test_metadata_key_needs_no_network():
+    assert caches.metadata_key(VIDEO_URL) == 'Youtube:dQw4w9WgXcQ'
+    assert caches.metadata_key('https://youtu.be/dQw4w9WgXcQ') == 'Youtube:dQw4w9WgXcQ'
+
+
+def test_chosen_format_is_kept_per_selector(tmp_path, monkeypatch):
+    monkeypatch.setattr(caches, '_metadata_cache', MetadataCache(str(tmp_path / 'metadata.db')))
+    # A caller on yt-dlp's default video+audio selection fills the entry first
+    info, hit = caches.cached_extract_info(FakeYoutubeDL(), VIDEO_URL)
+    assert not hit and 'formats' in info
+
+    audio_ydl = FakeYoutubeDL(AUDIO_SELECTOR)
+    info, hit = caches.cached_extract_info(audio_ydl, VIDEO_URL)
+    assert hit and audio_ydl.extractions == 0
+    assert info['title'] == 'Song' and info['duration'] == 212
+    # Neither the expiring format URLs nor the default selection's format were stored
+    assert 'formats' not in info and 'chosen_formats' not in info
+
+    caches.get_metadata_cache().put('Youtube:dQw4w9WgXcQ', audio_ydl.extract_info(VIDEO_URL), AUDIO_SELECTOR)
+    info, _ = caches.cached_extract_info(audio_ydl, VIDEO_URL)
+    assert info['chosen_formats'] == {AUDIO_SELECTOR: {'format_id': '251', 'ext': 'webm'}}
+
+
+def test_metadata_expires_after_ttl(tmp_path, monkeypatch):
+    cache = MetadataCache(str(tmp_path / 'metadata.db'), ttl=60)
+    cache.put('Youtube:a', {'title': 'A'})
+    assert cache.get('Youtube:a') == {'title': 'A'}
+    now = caches.time.time()
+    monkeypatch.setattr(caches.time, 'time', lambda: now + 61)
+    assert cache.get('Youtube:a') is None
+    assert cache.stats() == {'entries': 0, 'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_metadata_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(caches.time, 'time', lambda: next(clock))
+    cache = MetadataCache(str(tmp_path / 'metadata.db'), max_entries=2)
+    cache.put('Youtube:a', {'title': 'A'})
+    cache.put('Youtube:b', {'title': 'B'})
+    cache.get('Youtube:a')
+    cache.put('Youtube:c', {'title': 'C'})
+    assert cache.get('Youtube:b') is None
+    assert cache.get('Youtube:a') and cache.get('Youtube:c')
+
+
+def write_file(path, size, fill=b'x'):
+    path.write_bytes(fill * size)
+    return str(path)
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(caches.time, 'time', lambda: next(clock))
+    cache = FileCache(str(tmp_path / 'cache'), max_bytes=250)
+    cache.put('a', write_file(tmp_path / 'a.webm', 100, b'a'), {'title': 'A'})
+    cache.put('b', write_file(tmp_path / 'b.webm', 100, b'b'))
+    path, entry = cache.fetch('a', str(tmp_path / 'job_a'))
+    assert path == str(tmp_path / 'job_a.webm')
+    assert entry['size'] == 100 and entry['meta'] == {'title': 'A'}
+
+    # Over the quota, the entry used longest ago goes and its file with it
+    cache.put('c', write_file(tmp_path / 'c.webm', 100, b'c'))
+    assert cache.fetch('b', str(tmp_path / 'job_b')) is None
+    assert cache.fetch('c', str(tmp_path / 'job_c')) is not None
+    blobs = [name for name in os.listdir(tmp_path / 'cache') if name.endswith('.webm')]
+    assert len(blobs) == 2
+    # The job's own link outlives eviction of the entry it came from
+    cache.put('d', write_file(tmp_path / 'd.webm', 100, b'd'))
+    cache.put('e', write_file(tmp_path / 'e.webm', 100, b'e'))
+    assert cache.fetch('a', str(tmp_path / 'job_a2')) is None
+    assert (tmp_path / 'job_a.webm').read_bytes() == b'a' * 100
+
+
+def test_file_cache_stores_identical_content_once(tmp_path):
+    cache = FileCache(str(tmp_path / 'cache'), max_bytes=1000)
+    first = cache.put('Youtube:a', write_file(tmp_path / 'one.webm', 100))
+    second = cache.put('Youtube:a-mirror', write_file(tmp_path / 'two.webm', 100))
+    assert first == second
+    assert [name for name in os.listdir(tmp_path / 'cache') if name.endswith('.webm')] == [first + '.webm']
+    # A file larger than the whole quota is never cached
+    cache.put('huge', write_file(tmp_path / 'huge.webm', 2000))
+    assert cache.fetch('huge', str(tmp_path / 'job')) is None
+    assert cache.stats()['entries'] == 2
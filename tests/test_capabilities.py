@@ -0,0 +1,76 @@
+import capabilities
+from capabilities import FFmpegCapabilities, probe_capabilities
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+ V....D h264_nvenc           NVIDIA NVENC H.264 encoder (codec h264)
+ V....D h264_qsv             H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (Intel Quick Sync Video acceleration) (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+ A....D libmp3lame           libmp3lame MP3 (MPEG audio layer 3) (codec mp3)
+"""
+
+DEMUXERS = """File formats:
+ D. = Demuxing supported
+ E. = Muxing supported
+ --
+ D  concat          Virtual concatenation script
+ D  gif             CompuServe Graphics Interchange Format (GIF)
+ D  mov,mp4,m4a,3gp,3g2,mj2 QuickTime / MOV
+"""
+
+FILTERS = """Filters:
+  T.. = Timeline support
+  .S. = Slice threading
+  ... = Command support
+  A = Audio input/output
+  V = Video input/output
+  N = Dynamic number and/or type of input/output
+  | = Source or sink filter
+ TSC loudnorm          A->A       EBU R128 loudness normalization
+ ... concat            N->N       Concatenate audio and video streams.
+ T.C scale_cuda        V->V       GPU accelerated video resizer
+ ... color             |->V       Provide an uniformly colored input.
+"""
+
+HWACCELS = """Hardware acceleration methods:
+cuda
+qsv
+"""
+
+HELP = """Advanced Video options:
+-vsync                       set video sync method globally; deprecated, use -fps_mode
+-fps_mode[:<stream_spec>] <mode>  set framerate mode for matching video streams; overrides vsync
+"""
+
+
+def test_probe_parses_ffmpeg_listings(monkeypatch):
+    listings = {'-encoders': ENCODERS, '-demuxers': DEMUXERS, '-filters': FILTERS, '-hwaccels': HWACCELS, '-h long': HELP}
+    monkeypatch.setattr(capabilities, '_run', lambda ffmpeg_path, *options: listings[' '.join(options)])
+    # NVENC is listed but this machine has no NVIDIA GPU, so its test encode fails
+    monkeypatch.setattr(capabilities, '_test_encode', lambda ffmpeg_path, encoder: encoder == 'h264_qsv')
+
+    data = probe_capabilities('ffmpeg')
+    assert data['encoders'] == ['libx264', 'h264_nvenc', 'h264_qsv', 'aac', 'libmp3lame']
+    assert data['hw_encoders'] == ['h264_qsv']
+    assert data['demuxers'] == ['concat', 'gif', 'mov', 'mp4', 'm4a', '3gp', '3g2', 'mj2']
+    assert data['filters'] == ['loudnorm', 'concat', 'scale_cuda', 'color']
+    assert data['hwaccels'] == ['cuda', 'qsv']
+    assert data['fps_mode']
+
+    caps = FFmpegCapabilities(data)
+    assert caps.known
+    assert caps.can_encode('libx264') and caps.can_encode('h264_qsv')
+    assert not caps.can_encode('h264_nvenc')
+    assert not caps.can_encode('libx265')
+    assert caps.has_filter('loudnorm') and not caps.has_filter('rubberband')
+    assert caps.has_fps_mode
+
+
+def test_unprobed_ffmpeg_is_unknown():
+    caps = FFmpegCapabilities({})
+    assert not caps.known
+    assert not caps.has_fps_mode
+    assert not caps.can_encode('libx264')
@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+
+import pytest
+
+from jobs import JobManager, QueueFull
+from jobstore import JobStore, FINISHED_STATES
+
+
+def wait_for(manager, job_id, timeout=20):
+    """Block until a job finishes and return its record"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in FINISHED_STATES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish: {manager.get(job_id)}")
+
+
+def crashing_task(update_status, cancel_event=None, crash=False):
+    if crash:
+        # Kill the worker process the way a segfaulting ffmpeg binding or the OOM killer would
+        os._exit(1)
+    update_status(status='processing', progress=10)
+    update_status(status='complete', progress=100, message='done')
+
+
+def test_process_pool_recovers_from_a_dead_worker(tmp_path):
+    manager = JobManager(crashing_task, 1, JobStore(str(tmp_path / 'jobs.db')), mode='process')
+    crashed = wait_for(manager, manager.submit({'crash': True}))
+    assert crashed['status'] == 'error'
+
+    # The broken pool is replaced, so later jobs still run
+    for _ in range(2):
+        assert wait_for(manager, manager.submit({}))['status'] == 'complete'
+    assert manager._running == 0
+
+
+def test_only_waiting_jobs_are_estimated(tmp_path):
+    release = threading.Event()
+    estimated = []
+
+    def task(update_status, cancel_event=None, name=None):
+        update_status(status='processing')
+        release.wait(10)
+        update_status(status='complete', progress=100)
+
+    def estimator(params):
+        estimated.append(params['name'])
+        return {'estimated_cost': 10}
+
+    manager = JobManager(task, 1, JobStore(str(tmp_path / 'jobs.db')), cost_estimator=estimator)
+    first = manager.submit({'name': 'first'})
+    second = manager.submit({'name': 'second'})
+    manager._estimator_pool.shutdown(wait=True)
+    # The first job started straight away, so only the one left waiting paid for an estimate
+    assert estimated == ['second']
+    assert manager.get(second)['stats']['estimated_cost'] == 10
+    release.set()
+    assert wait_for(manager, first)['status'] == 'complete'
+    assert wait_for(manager, second)['status'] == 'complete'
+
+
+def test_finished_jobs_leave_no_watch_state(tmp_path):
+    release = threading.Event()
+
+    def task(update_status, cancel_event=None):
+        update_status(status='processing', progress=10)
+        release.wait(10)
+        update_status(status='complete', progress=100)
+
+    manager = JobManager(task, 2, JobStore(str(tmp_path / 'jobs.db')))
+    unwatched = manager.submit({})
+    watched = manager.submit({})
+    statuses = []
+
+    def watch():
+        # Follows a job the way the SSE endpoint does
+        version = -1
+        while True:
+            job, version = manager.wait_for_update(watched, version, timeout=5)
+            statuses.append(job['status'])
+            if job['status'] in FINISHED_STATES:
+                return
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    release.set()
+    watcher.join(10)
+    wait_for(manager, unwatched)
+    assert statuses[-1] == 'complete'
+    assert manager._versions == {} and manager._changed == {} and manager._watchers == {}
+    # Watching a job that has already finished returns at once and leaves nothing behind
+    job, _ = manager.wait_for_update(watched, -1, timeout=5)
+    assert job['status'] == 'complete'
+    assert manager._versions == {} and manager._changed == {}
+
+
+@pytest.mark.parametrize('aging, expected', [
+    # Enqueued half a second apart, the cheaper job goes first...
+    (1.0, ['short', 'long']),
+    # ...unless waiting counts for so much that the older one has aged past it
+    (1000.0, ['long', 'short']),
+])
+def test_queue_runs_cheapest_job_first_with_aging(tmp_path, aging, expected):
+    release = threading.Event()
+    started = []
+
+    def task(update_status, cancel_event=None, name=None, cost=None):
+        update_status(status='processing')
+        started.append(name)
+        if name == 'blocker':
+            release.wait(10)
+        update_status(status='complete', progress=100)
+
+    manager = JobManager(task, 1, JobStore(str(tmp_path / 'jobs.db')),
+                         cost_estimator=lambda params: {'estimated_cost': params['cost']}, aging=aging)
+    jobs = [manager.submit({'name': 'blocker', 'cost': 0}), manager.submit({'name': 'long', 'cost': 300})]
+    time.sleep(0.5)
+    jobs.append(manager.submit({'name': 'short', 'cost': 10}))
+    manager._estimator_pool.shutdown(wait=True)
+    release.set()
+    for job_id in jobs:
+        assert wait_for(manager, job_id)['status'] == 'complete'
+    assert started == ['blocker'] + expected
+
+
+def test_admission_rejects_with_retry_after(tmp_path):
+    release = threading.Event()
+
+    def task(update_status, cancel_event=None):
+        update_status(status='processing')
+        release.wait(10)
+        update_status(status='complete', progress=100)
+
+    manager = JobManager(task, 1, JobStore(str(tmp_path / 'jobs.db')), max_queue_depth=1)
+    jobs = [manager.submit({}), manager.submit({})]
+    with pytest.raises(QueueFull) as rejected:
+        manager.submit({})
+    # No job has finished yet, so one worker is assumed to clear a job every DEFAULT_JOB_SECONDS
+    assert rejected.value.estimated_wait == 2 * JobManager.DEFAULT_JOB_SECONDS
+    assert rejected.value.retry_after == JobManager.DEFAULT_JOB_SECONDS
+    assert manager.queue_stats()['queued'] == 1
+
+    release.set()
+    for job_id in jobs:
+        assert wait_for(manager, job_id)['status'] == 'complete'
+    # Once the queue has drained a new job is admitted again
+    assert wait_for(manager, manager.submit({}))['status'] == 'complete'
+
+
+def test_admission_limits_estimated_wait(tmp_path):
+    release = threading.Event()
+
+    def task(update_status, cancel_event=None):
+        update_status(status='processing')
+        release.wait(10)
+        update_status(status='complete', progress=100)
+
+    manager = JobManager(task, 2, JobStore(str(tmp_path / 'jobs.db')), max_queue_wait=30)
+    running = [manager.submit({}), manager.submit({})]
+    # Both workers are busy, so a third job would wait a full job's run time
+    with pytest.raises(QueueFull) as rejected:
+        manager.submit({})
+    assert rejected.value.estimated_wait == JobManager.DEFAULT_JOB_SECONDS / 2
+    # Two workers clear a job a minute between them, which is all the excess wait needs
+    assert rejected.value.retry_after == 60
+    release.set()
+    for job_id in running:
+        wait_for(manager, job_id)
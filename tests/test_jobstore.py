@@ -0,0 +1,60 @@
+import jobstore
+from jobstore import JobStore
+
+
+class Clock:
+    """Stands in for the time module so stage timings come out exact"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_stage_changes_record_timings(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobstore, 'time', clock)
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    store.create('a', {'url': 'x'})
+
+    clock.now = 1001.0
+    store.update('a', status='processing', stage='download', progress=15)
+    clock.now = 1004.0
+    store.update('a', stage='render', progress=50, metadata_seconds=1.5)
+    clock.now = 1005.0
+    # Progress within a stage leaves its clock running
+    store.update('a', progress=60)
+    clock.now = 1009.0
+    store.update('a', status='complete', progress=100)
+
+    job = store.get('a')
+    assert job['stage_timings'] == {'download': 3.0, 'render': 5.0}
+    assert job['stage'] is None
+    assert job['stats'] == {'metadata_seconds': 1.5}
+    assert (job['started_at'], job['finished_at']) == (1001.0, 1009.0)
+    assert store.recent_run_times() == [8.0]
+    # A finished job is not reopened by a late update
+    assert not store.update('a', status='processing')
+    assert store.get('a')['status'] == 'complete'
+
+
+def test_requeue_interrupted_resets_unfinished_jobs(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobstore, 'time', clock)
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    for job_id in ('waiting', 'running', 'done'):
+        clock.now += 1
+        store.create(job_id, {'name': job_id})
+    store.update('running', status='processing', stage='render', progress=70, speed=2.0)
+    store.update('done', status='complete')
+
+    assert store.requeue_interrupted(states=('queued',)) == [('waiting', {'name': 'waiting'})]
+    assert store.get('running')['status'] == 'processing'
+
+    assert store.requeue_interrupted() == [('waiting', {'name': 'waiting'}), ('running', {'name': 'running'})]
+    running = store.get('running')
+    assert (running['status'], running['progress'], running['stage'], running['speed'], running['started_at']) == \
+        ('queued', 0, None, None, None)
+    assert store.get('done')['status'] == 'complete'
+    assert store.count(['queued']) == 2
@@ -0,0 +1,286 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+import queues
+import worker
+from jobs import JobManager
+from jobstore import JobStore
+from queues import RedisQueue, SQLiteQueue
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    """Serves one client connection of the RESP stand-in"""
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2].decode())
+            try:
+                reply = self.server.store.execute(args[0].upper(), args[1:])
+            except Exception as e:
+                self.wfile.write(b'-ERR %s\r\n' % str(e).encode())
+                continue
+            self.wfile.write(encode(reply))
+
+
+def encode(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if reply is True:
+        return b'+OK\r\n'
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(encode(item) for item in reply)
+    data = str(reply).encode()
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+
+class RedisStandIn:
+    """In-memory subset of the Redis commands RedisQueue sends, with blocking pops"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.zsets = {}
+        self.lists = {}
+        self.strings = {}
+        self.changed = threading.Condition()
+
+    def execute(self, command, args):
+        with self.changed:
+            if command in ('BZPOPMIN', 'BLPOP'):
+                deadline = time.time() + float(args[1])
+                while True:
+                    reply = self._zpopmin(args[0]) if command == 'BZPOPMIN' else self._lpop(args[0], 'blocking')
+                    if reply is not None or time.time() >= deadline:
+                        return reply
+                    self.changed.wait(deadline - time.time())
+            reply = getattr(self, '_' + command.lower())(*args)
+            self.changed.notify_all()
+            return reply
+
+    def _auth(self, password):
+        return True
+
+    def _select(self, db):
+        return True
+
+    def _hset(self, key, field, value):
+        added = field not in self.hashes.setdefault(key, {})
+        self.hashes[key][field] = value
+        return int(added)
+
+    def _hsetnx(self, key, field, value):
+        if field in self.hashes.setdefault(key, {}):
+            return 0
+        self.hashes[key][field] = value
+        return 1
+
+    def _hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def _hdel(self, key, field):
+        return int(self.hashes.get(key, {}).pop(field, None) is not None)
+
+    def _zadd(self, key, *args):
+        zset = self.zsets.setdefault(key, {})
+        score, member = args[-2:]
+        if 'XX' in args[:-2] and member not in zset or 'NX' in args[:-2] and member in zset:
+            return 0
+        added = member not in zset
+        zset[member] = float(score)
+        return int(added)
+
+    def _zscore(self, key, member):
+        return self.zsets.get(key, {}).get(member)
+
+    def _zrem(self, key, member):
+        return int(self.zsets.get(key, {}).pop(member, None) is not None)
+
+    def _zrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        zset = self.zsets.get(key, {})
+        return [member for member, score in sorted(zset.items(), key=lambda item: item[1]) if low <= score <= high]
+
+    def _zpopmin(self, key):
+        zset = self.zsets.get(key)
+        if not zset:
+            return None
+        member = min(zset, key=zset.get)
+        return [key, member, zset.pop(member)]
+
+    def _rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+        return len(self.lists[key])
+
+    def _lpop(self, key, *blocking):
+        values = self.lists.get(key)
+        if not values:
+            return None
+        value = values.pop(0)
+        return [key, value] if blocking else value
+
+    def _set(self, key, value, *expiry):
+        self.strings[key] = value
+        return True
+
+    def _exists(self, key):
+        return int(key in self.strings)
+
+    def _del(self, key):
+        return int(self.strings.pop(key, None) is not None)
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        yield SQLiteQueue(str(tmp_path / 'queue.db'))
+        return
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RespHandler)
+    server.daemon_threads = True
+    server.store = RedisStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield RedisQueue(f'redis://127.0.0.1:{server.server_address[1]}/0')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_jobs_are_claimed_in_sort_key_order(backend):
+    backend.push('a', {'n': 1}, 30)
+    backend.push('b', {'n': 2}, 20)
+    backend.push('c', {'n': 3}, 10)
+    backend.reprioritize('a', 5)
+    assert backend.pop('w1', timeout=1) == ('a', {'n': 1})
+    # A claimed job keeps its place whatever the estimator says later
+    backend.reprioritize('a', 50)
+    assert not backend.remove('a')
+    assert backend.remove('b')
+    assert backend.pop('w1', timeout=1) == ('c', {'n': 3})
+    assert backend.pop('w1', timeout=0) is None
+    backend.ack('a', 'w1')
+    backend.ack('c', 'w1')
+    assert backend.requeue_expired() == []
+
+
+def test_cancel_requests_and_status_events(backend):
+    backend.push('a', {}, 1)
+    assert not backend.is_cancel_requested('a')
+    backend.request_cancel('a')
+    assert backend.is_cancel_requested('a')
+    backend.publish_status('a', {'status': 'processing', 'progress': 10})
+    backend.publish_status('a', {'progress': 20})
+    assert backend.consume_status(timeout=1) == [('a', {'status': 'processing', 'progress': 10}), ('a', {'progress': 20})]
+    backend.ack('a', 'w1')
+    assert not backend.is_cancel_requested('a')
+
+
+def test_expired_claims_go_back_to_the_queue(backend, monkeypatch):
+    monkeypatch.setattr(queues, 'CLAIM_LEASE_SECONDS', 0.5)
+    backend.push('a', {'n': 1}, 10)
+    backend.push('b', {'n': 2}, 20)
+    assert backend.pop('w1', timeout=1) == ('a', {'n': 1})
+    time.sleep(0.3)
+    backend.renew('a')
+    time.sleep(0.3)
+    # Renewed 0.3 s ago, so the claim is still live
+    assert backend.requeue_expired() == []
+    time.sleep(0.4)
+    assert backend.requeue_expired() == ['a']
+    assert backend.consume_status(timeout=1) == [('a', queues.REQUEUED_FIELDS)]
+    # The job comes back with its old sort key, ahead of the one that was behind it
+    assert backend.pop('w2', timeout=1) == ('a', {'n': 1})
+    backend.ack('a', 'w2')
+    assert backend.pop('w2', timeout=1) == ('b', {'n': 2})
+
+
+def test_restore_skips_claimed_and_finished_jobs(backend):
+    backend.push('running', {'n': 1}, 10)
+    backend.push('done', {'n': 2}, 20)
+    assert backend.pop('w1', timeout=1)[0] == 'running'
+    assert backend.pop('w1', timeout=1)[0] == 'done'
+    backend.ack('done', 'w1')
+    assert not backend.restore('running', {'n': 1}, 10)
+    assert not backend.restore('done', {'n': 2}, 20)
+    assert backend.restore('lost', {'n': 3}, 30)
+    # A job that is still waiting keeps its place and its parameters
+    assert not backend.restore('lost', {'n': 4}, 1)
+    assert backend.pop('w2', timeout=1) == ('lost', {'n': 3})
+    assert backend.pop('w2', timeout=0) is None
+
+
+def test_restarted_web_app_does_not_requeue_finished_jobs(backend, tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    store.create('a', {'n': 1})
+    backend.push('a', {'n': 1}, 10)
+    # A worker renders the job while the web app is down
+    assert backend.pop('w1', timeout=1) == ('a', {'n': 1})
+    backend.publish_status('a', {'status': 'processing', 'progress': 10})
+    backend.publish_status('a', {'status': 'complete', 'progress': 100})
+    backend.ack('a', 'w1')
+
+    manager = JobManager(lambda update_status, **params: None, 1, store, backend=backend)
+    manager.start()
+    assert store.get('a')['status'] == 'complete'
+    assert backend.pop('w1', timeout=0) is None
+
+
+def test_stale_ack_leaves_a_reclaimed_job_alone(backend, monkeypatch):
+    monkeypatch.setattr(queues, 'CLAIM_LEASE_SECONDS', 0.2)
+    backend.push('a', {'n': 1}, 10)
+    backend.push('b', {'n': 2}, 20)
+    assert backend.pop('w1', timeout=1)[0] == 'a'
+    assert backend.pop('w1', timeout=1)[0] == 'b'
+    time.sleep(0.3)
+    assert sorted(backend.requeue_expired()) == ['a', 'b']
+    assert backend.pop('w2', timeout=1) == ('a', {'n': 1})
+    # w1 finishes late: 'a' now belongs to w2, and the re-queued 'b' nobody took is done
+    backend.ack('a', 'w1')
+    backend.ack('b', 'w1')
+    assert backend.pop('w3', timeout=0) is None
+    time.sleep(0.3)
+    assert backend.requeue_expired() == ['a']
+    assert backend.pop('w3', timeout=1) == ('a', {'n': 1})
+
+
+def test_redis_job_without_params_is_reported_lost(backend):
+    if not isinstance(backend, RedisQueue):
+        pytest.skip("only the Redis backend keeps parameters apart from the queue entry")
+    backend.push('a', {'n': 1}, 10)
+    backend._execute('HDEL', backend.params_key, 'a')
+    assert backend.pop('w1', timeout=1) is None
+    assert backend.consume_status(timeout=1) == [('a', queues.LOST_FIELDS)]
+    assert backend.requeue_expired() == []
+
+
+def test_stopping_worker_hands_running_jobs_back(backend, monkeypatch):
+    started = threading.Event()
+
+    def task(update_status, cancel_event=None, **params):
+        update_status(status='processing', progress=10)
+        started.set()
+        cancel_event.wait(10)
+        update_status(status='cancelled', message='Job cancelled')
+
+    monkeypatch.setattr(worker, 'process_video_task', task)
+    backend.push('a', {'n': 1}, 10)
+    job_id, params = backend.pop('w1', timeout=1)
+    running, stop = {}, threading.Event()
+    thread = threading.Thread(target=worker.run_job, args=(backend, 'w1', job_id, params, running, stop))
+    thread.start()
+    assert started.wait(5)
+    # What main() does on Ctrl-C
+    stop.set()
+    running['a'].set()
+    thread.join(5)
+    assert backend.consume_status(timeout=1) == [('a', {'status': 'processing', 'progress': 10}), ('a', queues.REQUEUED_FIELDS)]
+    assert backend.pop('w2', timeout=1) == ('a', {'n': 1})
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from capabilities import FFmpegCapabilities
+import render
+
+
+def fake_streams(video_duration, audio_duration):
+    return {
+        'format': {'format_name': 'mov,mp4,m4a,3gp,3g2,mj2', 'duration': str(max(video_duration, audio_duration))},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'h264', 'pix_fmt': 'yuv420p', 'duration': str(video_duration)},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'duration': str(audio_duration)},
+        ],
+    }
+
+
+@pytest.fixture
+def looped_render(monkeypatch, tmp_path):
+    """Run render_looped with ffmpeg/ffprobe replaced, returning the mux calls it made"""
+    muxes = []
+
+    def render_looped(media_type, audio_duration, video_duration, segment_duration):
+        monkeypatch.setattr(render, 'prepare_audio', lambda *args, **kwargs: ('audio.m4a', '-c:a copy', audio_duration))
+        monkeypatch.setattr(render, 'concat_and_mux', lambda video_files, *args, **kwargs: muxes.append(video_files))
+        monkeypatch.setattr(render, 'probe_streams', lambda media_file: fake_streams(video_duration, audio_duration))
+        render.render_looped(lambda **fields: None, media_type, 'background', 'source', 'out.mp4', 1.4, audio_duration,
+                             str(tmp_path), {'codec_name': 'h264'}, segment=('segment.mp4', segment_duration))
+        return muxes
+
+    return render_looped
+
+
+def test_still_render_keeps_last_frame_overhang(looped_render):
+    # 10.3 s of audio is not a whole number of 0.5 s still frames, so the copied video ends on 10.5 s
+    muxes = looped_render('image', audio_duration=10.3, video_duration=10.5, segment_duration=10.0)
+    assert len(muxes[0]) == 2
+
+
+def test_still_render_rejects_real_drift(looped_render):
+    with pytest.raises(Exception, match='out of sync'):
+        looped_render('image', audio_duration=10.3, video_duration=11.2, segment_duration=10.0)
+
+
+def test_still_render_rejects_short_video(looped_render):
+    with pytest.raises(Exception, match='out of sync'):
+        looped_render('image', audio_duration=10.3, video_duration=9.9, segment_duration=10.0)
+
+
+def test_gif_render_allows_its_longest_frame(looped_render, monkeypatch):
+    monkeypatch.setattr(render, 'longest_frame_duration', lambda video_file: 1.0)
+    looped_render('gif', audio_duration=10.3, video_duration=11.2, segment_duration=5.0)
+
+
+def test_check_av_sync_counts_audio_overhang(monkeypatch):
+    # Only the video may run long by a frame; audio left without picture is still drift
+    monkeypatch.setattr(render, 'probe_streams', lambda media_file: fake_streams(10.0, 10.6))
+    with pytest.raises(Exception, match='out of sync'):
+        render.check_av_sync('out.mp4', frame_duration=0.5)
+
+
+def test_reserved_output_paths_never_collide(tmp_path):
+    first = render.reserve_output_path(str(tmp_path), 'nightcore_Song.mp4')
+    second = render.reserve_output_path(str(tmp_path), 'nightcore_Song.mp4')
+    third = render.reserve_output_path(str(tmp_path), 'nightcore_Song.mp4')
+    assert first == str(tmp_path / 'nightcore_Song.mp4')
+    assert len({first, second, third}) == 3
+    assert all(os.path.basename(path).startswith('nightcore_Song') and path.endswith('.mp4') for path in (second, third))
+
+
+@pytest.mark.parametrize('has_fps_mode, expected', [(True, '-fps_mode passthrough'), (False, '-vsync passthrough')])
+def test_gif_timing_matches_the_ffmpeg_version(monkeypatch, has_fps_mode, expected):
+    monkeypatch.setattr(render, 'probe_gif_cycle', lambda gif_file: (2.0, 20))
+    monkeypatch.setattr(render, 'get_capabilities', lambda ffmpeg_path: FFmpegCapabilities({'fps_mode': has_fps_mode}))
+    assert render.gif_timing(lambda **fields: None, 'background.gif') == expected
+    # A GIF faster than the cap is resampled, which every ffmpeg understands
+    monkeypatch.setattr(render, 'probe_gif_cycle', lambda gif_file: (1.0, 100))
+    assert render.gif_timing(lambda **fields: None, 'background.gif') == f'-r {render.GIF_MAX_FPS:g}'
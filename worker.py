@@ -0,0 +1,123 @@
+"""Render worker: pulls jobs from the shared queue backend and runs the render pipeline
+
+Run one or more of these next to (or away from) the web app, which then only
+queues jobs and serves results:
+
+    SPEDUP_QUEUE_BACKEND=redis SPEDUP_REDIS_URL=redis://queue-host:6379/0 python worker.py
+    python worker.py --backend sqlite --concurrency 2
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+
+from jobstore import FINISHED_STATES
+from queues import QUEUE_BACKEND, open_queue_backend
+from render import process_video_task, init_worker, default_worker_count
+
+# How often running jobs renew their claims and are checked for cancel requests
+CANCEL_POLL_SECONDS = 1.0
+
+
+def run_job(backend, worker_id, job_id, params, running, stop):
+    """Render one claimed job, publishing its status back through the backend
+
+    A job interrupted because the worker is stopping is handed back to the
+    queue for another worker instead of being reported cancelled.
+    """
+    cancel_event = threading.Event()
+    running[job_id] = cancel_event
+    finished = []
+
+    def update_status(**fields):
+        if fields.get('status') in FINISHED_STATES:
+            if stop.is_set() and fields['status'] != 'complete':
+                # Cut short by the shutdown; the job is released below rather than reported
+                return
+            finished.append(fields['status'])
+        backend.publish_status(job_id, fields)
+
+    try:
+        process_video_task(update_status, cancel_event=cancel_event, **params)
+    except Exception as e:
+        # process_video_task reports its own errors; this only catches the unexpected ones
+        update_status(status='error', message=f'Error creating video: {str(e)}')
+        print(f"Unhandled error in job {job_id}: {e}")
+    finally:
+        running.pop(job_id, None)
+        if finished or not stop.is_set():
+            backend.ack(job_id, worker_id)
+        else:
+            backend.release(job_id, worker_id)
+
+
+def watch_cancellations(backend, running, stop):
+    """Renew the claims of running jobs and set the cancel event of any the web app asked to cancel"""
+    while not stop.is_set():
+        for job_id, cancel_event in list(running.items()):
+            try:
+                backend.renew(job_id)
+                if backend.is_cancel_requested(job_id):
+                    cancel_event.set()
+            except Exception as e:
+                print(f"Error renewing the claim or checking cancel requests for {job_id}: {e}")
+        stop.wait(CANCEL_POLL_SECONDS)
+
+
+def worker_loop(backend, worker_id, running, stop):
+    while not stop.is_set():
+        try:
+            claimed = backend.pop(worker_id, timeout=5)
+        except Exception as e:
+            print(f"Error reading the job queue: {e}")
+            time.sleep(5)
+            continue
+        if claimed is None:
+            continue
+        job_id, params = claimed
+        if stop.is_set():
+            backend.release(job_id, worker_id)
+            return
+        print(f"[{worker_id}] Starting job {job_id}")
+        run_job(backend, worker_id, job_id, params, running, stop)
+        print(f"[{worker_id}] Finished job {job_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spedup-Slowed-MV render worker")
+    parser.add_argument('--backend', default=QUEUE_BACKEND or 'sqlite', choices=['sqlite', 'redis'],
+                        help="queue backend shared with the web app (default: SPEDUP_QUEUE_BACKEND or sqlite)")
+    parser.add_argument('--concurrency', type=int, default=default_worker_count(),
+                        help="jobs this worker renders at the same time (default: CPU count / SPEDUP_FFMPEG_THREADS)")
+    args = parser.parse_args()
+
+    init_worker()
+    backend = open_queue_backend(args.backend)
+    running = {}
+    stop = threading.Event()
+    worker_name = f"{socket.gethostname()}-{os.getpid()}"
+
+    threading.Thread(target=watch_cancellations, args=(backend, running, stop), daemon=True).start()
+    threads = []
+    for slot in range(args.concurrency):
+        thread = threading.Thread(target=worker_loop, args=(backend, f"{worker_name}-{slot}", running, stop), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    print(f"Worker {worker_name} waiting for jobs on the {args.backend} queue ({args.concurrency} slots)")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping worker...")
+        stop.set()
+        # Running jobs are stopped so their ffmpeg children and workspaces are cleaned up; run_job hands them back to the queue
+        for cancel_event in list(running.values()):
+            cancel_event.set()
+        for thread in threads:
+            thread.join(timeout=10)
+
+
+if __name__ == '__main__':
+    main()